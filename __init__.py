@@ -24,4 +24,5 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.       #
 ###############################################################################
 
-from . import models
\ No newline at end of file
+from . import models
+from . import wizard
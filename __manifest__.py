@@ -46,7 +46,14 @@ Impuestos Colombia:
     ],
     'data': [
         'security/ir.model.access.csv',
+        'security/l10n_co_tax_extension_security.xml',
+        'data/ir_cron.xml',
         'views/l10n_co_tax_extension.xml',
+        'views/account_withholding_recompute_views.xml',
+        'views/account_withholding_summary_views.xml',
+        'wizard/account_base_tax_rollover_views.xml',
+        'wizard/account_withholding_certificate_views.xml',
+        'report/withholding_certificate_report.xml',
     ],
     'installable': True,
     'application': False,
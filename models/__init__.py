@@ -24,4 +24,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.       #
 ###############################################################################
 
-from . import l10n_co_tax_extension
\ No newline at end of file
+from . import instrumentation
+from . import account_withholding_recompute
+from . import account_withholding_summary
+from . import l10n_co_tax_extension
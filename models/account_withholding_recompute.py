@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#                                                                             #
+#                                                                             #
+# Part of Odoo. See LICENSE file for full copyright and licensing details.    #
+#                                                                             #
+#                                                                             #
+#                                                                             #
+# Co-Authors    Odoo LoCo                                                     #
+#               Localización funcional de Odoo para Colombia                  #
+#                                                                             #
+#                                                                             #
+# This program is free software: you can redistribute it and/or modify        #
+# it under the terms of the GNU Affero General Public License as published by #
+# the Free Software Foundation, either version 3 of the License, or           #
+# (at your option) any later version.                                         #
+#                                                                             #
+# This program is distributed in the hope that it will be useful,             #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of              #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the               #
+# GNU Affero General Public License for more details.                         #
+#                                                                             #
+# You should have received a copy of the GNU Affero General Public License    #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.       #
+###############################################################################
+
+import logging
+import time
+
+from odoo import api, fields, models
+
+from .account_withholding_summary import SUMMARY_STATES
+
+_logger = logging.getLogger(__name__)
+
+
+class AccountWithholdingRecompute(models.Model):
+    """ Job recomputing, in chunks committed one by one, the withholding taxes of the draft invoices
+    affected by a change of the withholding configuration"""
+
+    _name = 'account.withholding.recompute'
+    _description = 'Recompute of withholding taxes on draft invoices'
+    _order = 'id'
+
+    name = fields.Char(string='Description', required=True)
+    state = fields.Selection([('pending', 'Pending'),
+                              ('running', 'Running'),
+                              ('done', 'Done'),
+                              ('failed', 'Done with errors')], string='Status', default='pending', required=True)
+    position_ids = fields.Many2many('account.fiscal.position', string='Fiscal positions')
+    company_ids = fields.Many2many('res.company', string='Companies',
+                                   help='Companies whose own fiscal position is affected')
+    date_from = fields.Date(string='Since date')
+    date_to = fields.Date(string='Until date')
+    last_invoice_id = fields.Integer(string='Last invoice processed', default=0, readonly=True)
+    invoice_count = fields.Integer(string='Invoices to process', readonly=True)
+    processed_count = fields.Integer(string='Invoices processed', default=0, readonly=True)
+    failed_invoice_ids = fields.Many2many('account.invoice', string='Failed invoices', readonly=True,
+                                          help='Invoices that raised an error while recomputed, they are skipped')
+    progress = fields.Float(string='Progress', compute='_compute_progress')
+
+    @api.multi
+    @api.depends('invoice_count', 'processed_count')
+    def _compute_progress(self):
+        for job in self:
+            job.progress = job.invoice_count and 100.0 * job.processed_count / job.invoice_count or 0.0
+
+    @api.model
+    def _enqueue(self, positions, name, date_from=False, date_to=False):
+        """
+        Creates a job for the draft invoices of the given fiscal positions, also used as company
+        fiscal position, optionally restricted to a date range. No job is created when a pending job
+        already covers these positions and dates, that job is returned instead
+        @return: account.withholding.recompute record
+        """
+        positions = positions.exists()
+        if not positions:
+            return self
+        date_from = fields.Date.to_date(date_from)
+        date_to = fields.Date.to_date(date_to)
+        companies = self.env['res.company'].sudo().search([]).filtered(
+            lambda c: c.partner_id.with_context(force_company=c.id).property_account_position_id in positions)
+        for job in self.sudo().search([('state', '=', 'pending')]):
+            if (positions <= job.position_ids and companies <= job.company_ids
+                    and (not job.date_from or date_from and job.date_from <= date_from)
+                    and (not job.date_to or date_to and job.date_to >= date_to)):
+                return job
+        return self.sudo().create({
+            'name': name,
+            'position_ids': [(6, 0, positions.ids)],
+            'company_ids': [(6, 0, companies.ids)],
+            'date_from': date_from,
+            'date_to': date_to,
+        })
+
+    @api.multi
+    def _get_invoice_domain(self, states=('draft',)):
+        self.ensure_one()
+        domain = [('state', 'in', list(states))]
+        if self.company_ids:
+            domain += ['|', ('company_id', 'in', self.company_ids.ids)]
+        domain.append(('fiscal_position_id', 'in', self.position_ids.ids))
+        if self.date_from:
+            domain.append(('date_invoice', '>=', self.date_from))
+        if self.date_to:
+            domain.append(('date_invoice', '<=', self.date_to))
+        return domain
+
+    @api.multi
+    def _process(self, batch_size=200, deadline=None):
+        """
+        Recomputes the taxes of the invoices of the job in chunks of batch_size invoices ordered by id,
+        committing after each chunk. The job resumes after the last invoice processed, so it can be
+        stopped at any time, and stops by itself once the deadline (a time.time() value) is passed.
+        A chunk that raises is retried invoice by invoice, the invoices that still raise are logged and
+        skipped, and the job ends in the failed state
+        @return: True when the job is done
+        """
+        self.ensure_one()
+        invoice_model = self.env['account.invoice']
+        domain = self._get_invoice_domain()
+        if self.state == 'pending':
+            self.write({'state': 'running', 'invoice_count': invoice_model.search_count(domain)})
+            self.env.cr.commit()
+
+        while deadline is None or time.time() < deadline:
+            invoices = invoice_model.search(domain + [('id', '>', self.last_invoice_id)], order='id',
+                                            limit=batch_size)
+            if not invoices:
+                self._refresh_summary()
+                self.state = 'failed' if self.failed_invoice_ids else 'done'
+                self.env.cr.commit()
+                return True
+            failed = self._recompute_chunk(invoices)
+            self.write({
+                'last_invoice_id': invoices[-1].id,
+                'processed_count': self.processed_count + len(invoices),
+                'failed_invoice_ids': [(4, invoice.id) for invoice in failed],
+            })
+            self.env.cr.commit()
+            _logger.info('Withholding recompute %s: %d/%d invoices', self.id, self.processed_count,
+                         self.invoice_count)
+        return False
+
+    @api.multi
+    def _refresh_summary(self):
+        """ Rebuilds the withholding summary of the companies, partners and months of the validated invoices of
+        the job, whose summarized taxes may have changed with the configuration """
+        self.ensure_one()
+        query = self.env['account.invoice']._where_calc(self._get_invoice_domain(states=SUMMARY_STATES))
+        from_clause, where_clause, params = query.get_sql()
+        self.env.cr.execute("""
+            SELECT DISTINCT account_invoice.company_id, account_invoice.commercial_partner_id,
+                            date_trunc('month', account_invoice.date_invoice)::date
+              FROM {from_clause}
+             WHERE {where_clause} AND account_invoice.date_invoice IS NOT NULL
+        """.format(from_clause=from_clause, where_clause=where_clause), params)
+        self.env['account.withholding.summary'].sudo()._refresh(set(self.env.cr.fetchall()))
+
+    @api.multi
+    def _recompute_chunk(self, invoices):
+        """
+        Recomputes the invoices in a savepoint. When it fails, each invoice is recomputed in its own savepoint
+        @return: account.invoice recordset of the invoices that failed
+        """
+        try:
+            with self.env.cr.savepoint():
+                invoices._recompute_withholding()
+            return invoices.browse()
+        except Exception:
+            self.env.clear()
+            _logger.warning('Withholding recompute %s: chunk %s-%s failed, retrying invoice by invoice', self.id,
+                            invoices[0].id, invoices[-1].id)
+
+        failed = invoices.browse()
+        for invoice in invoices:
+            try:
+                with self.env.cr.savepoint():
+                    invoice._recompute_withholding()
+            except Exception:
+                self.env.clear()
+                _logger.exception('Withholding recompute %s: invoice %s failed and is skipped', self.id, invoice.id)
+                failed |= invoice
+        return failed
+
+    @api.model
+    def _cron_process_jobs(self, batch_size=200, time_limit=240):
+        """ Processes the pending jobs until time_limit seconds are spent, the next run resumes them """
+        deadline = time.time() + time_limit
+        for job in self.search([('state', 'in', ('pending', 'running'))]):
+            if not job._process(batch_size=batch_size, deadline=deadline):
+                break
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#                                                                             #
+#                                                                             #
+# Part of Odoo. See LICENSE file for full copyright and licensing details.    #
+#                                                                             #
+#                                                                             #
+#                                                                             #
+# Co-Authors    Odoo LoCo                                                     #
+#               Localización funcional de Odoo para Colombia                  #
+#                                                                             #
+#                                                                             #
+# This program is free software: you can redistribute it and/or modify        #
+# it under the terms of the GNU Affero General Public License as published by #
+# the Free Software Foundation, either version 3 of the License, or           #
+# (at your option) any later version.                                         #
+#                                                                             #
+# This program is distributed in the hope that it will be useful,             #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of              #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the               #
+# GNU Affero General Public License for more details.                         #
+#                                                                             #
+# You should have received a copy of the GNU Affero General Public License    #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.       #
+###############################################################################
+
+from odoo import api, fields, models
+
+# Invoice states whose withholding taxes are summarized
+SUMMARY_STATES = ('open', 'in_payment', 'paid')
+
+
+class AccountWithholdingSummary(models.Model):
+    """ Withheld amounts and bases per company, partner, tax and month of the validated invoices.
+    The rows of a (company, partner, month) are rebuilt each time one of its invoices is validated,
+    cancelled or set back to draft, and when a recompute job of the withholding configuration covering
+    its invoices is done"""
+
+    _name = 'account.withholding.summary'
+    _description = 'Withholding taxes summary'
+    _log_access = False
+    _order = 'month desc, partner_id, tax_id'
+
+    company_id = fields.Many2one('res.company', string='Company', readonly=True)
+    partner_id = fields.Many2one('res.partner', string='Partner', readonly=True)
+    tax_id = fields.Many2one('account.tax', string='Tax', readonly=True)
+    tax_group_id = fields.Many2one(related='tax_id.tax_group_id', store=True, readonly=True)
+    not_in_invoice = fields.Boolean(related='tax_id.tax_group_id.not_in_invoice', store=True, readonly=True)
+    dont_impact_balance = fields.Boolean(related='tax_id.dont_impact_balance', store=True, readonly=True)
+    type_tax_use = fields.Selection(related='tax_id.type_tax_use', store=True, readonly=True)
+    currency_id = fields.Many2one('res.currency', string='Currency', readonly=True)
+    month = fields.Date(string='Month', readonly=True)
+    invoice_count = fields.Integer(string='Invoices', readonly=True)
+    base = fields.Monetary(string='Base', readonly=True)
+    amount = fields.Monetary(string='Amount', readonly=True)
+
+    @api.model_cr
+    def init(self):
+        self._cr.execute('SELECT indexname FROM pg_indexes WHERE indexname = %s',
+                         ('account_withholding_summary_key_idx',))
+        if not self._cr.fetchone():
+            self._cr.execute('CREATE INDEX account_withholding_summary_key_idx '
+                             'ON account_withholding_summary (company_id, partner_id, month)')
+        self._cr.execute('SELECT 1 FROM account_withholding_summary LIMIT 1')
+        if not self._cr.fetchone():
+            self._refresh()
+
+    def _refresh(self, keys=None):
+        """
+        Rebuilds the rows of the given (company_id, partner_id, month) keys from the invoice tax lines,
+        or all the rows when keys is None
+        """
+        where = ''
+        params = {'states': SUMMARY_STATES, 'keys': tuple(keys or ())}
+        if keys is not None:
+            if not keys:
+                return
+            where = "AND (inv.company_id, inv.commercial_partner_id, date_trunc('month', inv.date_invoice)::date) IN %(keys)s"
+            self._cr.execute('DELETE FROM account_withholding_summary WHERE (company_id, partner_id, month) IN %(keys)s',
+                             params)
+        else:
+            self._cr.execute('DELETE FROM account_withholding_summary')
+
+        self._cr.execute("""
+            INSERT INTO account_withholding_summary (company_id, partner_id, tax_id, tax_group_id, not_in_invoice,
+                                                     dont_impact_balance, type_tax_use, currency_id, month,
+                                                     invoice_count, base, amount)
+                 SELECT inv.company_id, inv.commercial_partner_id, ait.tax_id, tax.tax_group_id,
+                        COALESCE(tax_group.not_in_invoice, FALSE), COALESCE(tax.dont_impact_balance, FALSE),
+                        tax.type_tax_use, inv.currency_id, date_trunc('month', inv.date_invoice)::date,
+                        COUNT(DISTINCT inv.id),
+                        SUM(CASE WHEN inv.type IN ('in_refund', 'out_refund') THEN -ait.base ELSE ait.base END),
+                        SUM(CASE WHEN inv.type IN ('in_refund', 'out_refund') THEN -ait.amount ELSE ait.amount END)
+                   FROM account_invoice_tax ait
+                   JOIN account_invoice inv ON inv.id = ait.invoice_id
+                   JOIN account_tax tax ON tax.id = ait.tax_id
+              LEFT JOIN account_tax_group tax_group ON tax_group.id = tax.tax_group_id
+                  WHERE inv.state IN %(states)s
+                    AND ait.tax_id IN (SELECT tax_id FROM account_fiscal_position_base_tax)
+                    {where}
+               GROUP BY inv.company_id, inv.commercial_partner_id, ait.tax_id, tax.tax_group_id,
+                        tax_group.not_in_invoice, tax.dont_impact_balance, tax.type_tax_use, inv.currency_id,
+                        date_trunc('month', inv.date_invoice)::date
+        """.format(where=where), params)
+        self.invalidate_cache()
+
+    @api.model
+    def _refresh_invoices(self, invoices):
+        """ Rebuilds the rows of the companies, partners and months of the invoices """
+        keys = {(invoice.company_id.id, invoice.commercial_partner_id.id,
+                 fields.Date.to_date(invoice.date_invoice).replace(day=1))
+                for invoice in invoices if invoice.date_invoice}
+        self._refresh(keys)
+
+    @api.model
+    def action_rebuild(self):
+        self._refresh()
+        return True
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#                                                                             #
+#                                                                             #
+# Part of Odoo. See LICENSE file for full copyright and licensing details.    #
+#                                                                             #
+#                                                                             #
+#                                                                             #
+# Co-Authors    Odoo LoCo                                                     #
+#               Localización funcional de Odoo para Colombia                  #
+#                                                                             #
+#                                                                             #
+# This program is free software: you can redistribute it and/or modify        #
+# it under the terms of the GNU Affero General Public License as published by #
+# the Free Software Foundation, either version 3 of the License, or           #
+# (at your option) any later version.                                         #
+#                                                                             #
+# This program is distributed in the hope that it will be useful,             #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of              #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the               #
+# GNU Affero General Public License for more details.                         #
+#                                                                             #
+# You should have received a copy of the GNU Affero General Public License    #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.       #
+###############################################################################
+
+import functools
+import logging
+import threading
+import time
+
+from odoo import api, models
+from odoo.exceptions import AccessError
+from odoo.tools.translate import _
+
+_logger = logging.getLogger(__name__)
+
+# Instrumentation is enabled by this system parameter, or per call by this context key
+INSTRUMENTATION_PARAM = 'l10n_co_tax_extension.instrumentation'
+INSTRUMENTATION_CONTEXT_KEY = 'l10n_co_instrumentation'
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _is_enabled(env):
+    if INSTRUMENTATION_CONTEXT_KEY in env.context:
+        return bool(env.context[INSTRUMENTATION_CONTEXT_KEY])
+    # get_param is cached per registry, no query is done once the parameter has been read
+    return env['ir.config_parameter'].sudo().get_param(INSTRUMENTATION_PARAM) in ('1', 'True', 'true')
+
+
+def instrumented(name):
+    """
+    Decorator recording the SQL query count, the elapsed time and the recordset size of each call of
+    a method, when the instrumentation is enabled. Nested instrumented calls are counted in both.
+    It must be the innermost decorator, so the api decorators still apply to the method
+    """
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not _is_enabled(self.env):
+                return method(self, *args, **kwargs)
+
+            cr = self.env.cr
+            queries = cr.sql_log_count
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                query_count = cr.sql_log_count - queries
+                _record(name, len(self), query_count, elapsed)
+                _logger.info('%s: %d records, %d queries, %.3f ms', name, len(self), query_count, elapsed * 1000.0)
+        return wrapper
+    return decorate
+
+
+def _record(name, records, queries, elapsed):
+    with _stats_lock:
+        stats = _stats.setdefault(name, {'calls': 0, 'records': 0, 'queries': 0, 'seconds': 0.0, 'max_seconds': 0.0})
+        stats['calls'] += 1
+        stats['records'] += records
+        stats['queries'] += queries
+        stats['seconds'] += elapsed
+        stats['max_seconds'] = max(stats['max_seconds'], elapsed)
+
+
+class AccountWithholdingStats(models.AbstractModel):
+    """ Exposes the counters of the withholding instrumentation. The counters are kept in memory
+    and belong to the server process (worker) that answers the call"""
+
+    _name = 'account.withholding.stats'
+    _description = 'Withholding computations instrumentation'
+
+    def _check_access(self):
+        if not self.env.user.has_group('base.group_system'):
+            raise AccessError(_('Only administrators can read the withholding instrumentation.'))
+
+    @api.model
+    def get_stats(self):
+        """
+        Returns the aggregated counters of each instrumented method
+        @return: dict
+        """
+        self._check_access()
+        with _stats_lock:
+            return {name: dict(stats) for name, stats in _stats.items()}
+
+    @api.model
+    def reset_stats(self):
+        self._check_access()
+        with _stats_lock:
+            _stats.clear()
+        return True
@@ -25,16 +25,33 @@
 ###############################################################################
 
 
+import csv
+import io
+import itertools
 import logging
+from collections import OrderedDict, namedtuple
 
-from odoo import api, fields, models
+from odoo import api, fields, models, tools
 from odoo.exceptions import UserError, ValidationError
 from odoo.tools import float_is_zero
+from odoo.tools.lru import LRU
 from odoo.tools.misc import formatLang
 from odoo.tools.translate import _
 
+from . import withholding_engine
+from .instrumentation import instrumented
+
 _logger = logging.getLogger(__name__)
 
+# Withholding configuration of a company, resolved from its own fiscal position
+WithholdingSnapshot = namedtuple('WithholdingSnapshot', ['company_id', 'position_id', 'config', 'tax_ids',
+                                                         'sale_tax_ids', 'purchase_tax_ids', 'counterpart_tax_ids'])
+
+# Withholding tax lines memoized on the inputs of the invoices. They are kept out of the registry ormcache,
+# which is shared with the core caches, and are keyed on a token renewed whenever that cache is cleared
+_wh_tax_values_memo = LRU(4096)
+_wh_cache_tokens = itertools.count()
+
 
 class AccountInvoice(models.Model):
     """ This Model calculates and saves withholding tax that apply in
@@ -62,107 +79,127 @@ class AccountInvoice(models.Model):
     amount_without_wh_tax = fields.Monetary('Total With Tax', store="True", compute="_compute_amount")
     wh_taxes = fields.Float(string="Withholding Tax", store=True, compute="_compute_amount")
     date_invoice = fields.Date(required=True)
+    wh_taxes_pending = fields.Boolean(string="Withholding lines pending", copy=False,
+                                      help="Set when the tax lines were previewed in the form and must be regenerated")
 
     # Calculate withholding tax and (new) total amount
 
-    @api.one
+    @api.multi
     @api.depends('invoice_line_ids.price_subtotal', 'tax_line_ids.amount', 'currency_id', 'company_id')
+    @instrumented('account.invoice._compute_amount')
     def _compute_amount(self):
         """
         This functions computes the withholding tax on the untaxed amount
         @return: void
         """
         super(AccountInvoice, self)._compute_amount()
-        fp_company = self.env['account.fiscal.position'].search(
-            [('id', '=', self.company_id.partner_id.property_account_position_id.id)])
-        company_tax_ids = [base_tax.tax_id.id for base_tax in fp_company.tax_ids_invoice]
 
-        if self.fiscal_position_id:
-            fp_partner = self.env['account.fiscal.position'].search(
-                [('id', '=', self.fiscal_position_id.id)])
+        # Prefetch the taxes of the tax lines, so the loop below only works on cached values.
+        self.mapped('tax_line_ids.tax_id')
+        get_wh_tax_ids = self.env['account.fiscal.position']._get_wh_tax_ids
+        get_wh_snapshot = self.env['res.company']._get_wh_snapshot
 
-            partner_tax_ids = [base_tax.tax_id.id for base_tax in fp_partner.tax_ids_invoice]
+        for invoice in self:
+            company_tax_ids = get_wh_snapshot(invoice.company_id.id).tax_ids
 
-            self.amount_tax = sum(
-                line.amount for line in self.tax_line_ids if line.tax_id.id not in (partner_tax_ids + company_tax_ids))
-            self.wh_taxes = abs(sum(line.amount for line in self.tax_line_ids if line.tax_id.id in partner_tax_ids))
-        else:
-            self.amount_tax = sum(line.amount for line in self.tax_line_ids if line.tax_id.id not in company_tax_ids)
+            if invoice.fiscal_position_id:
+                partner_tax_ids = get_wh_tax_ids(invoice.fiscal_position_id.id)
+                wh_tax_ids = partner_tax_ids | company_tax_ids
+
+                invoice.amount_tax = sum(
+                    line.amount for line in invoice.tax_line_ids if line.tax_id.id not in wh_tax_ids)
+                invoice.wh_taxes = abs(
+                    sum(line.amount for line in invoice.tax_line_ids if line.tax_id.id in partner_tax_ids))
+            else:
+                invoice.amount_tax = sum(
+                    line.amount for line in invoice.tax_line_ids if line.tax_id.id not in company_tax_ids)
+                invoice.wh_taxes = 0.0
 
-        self.amount_without_wh_tax = self.amount_untaxed + self.amount_tax
-        self.amount_total = self.amount_without_wh_tax - self.wh_taxes
-        sign = self.type in ['in_refund', 'out_refund'] and -1 or 1
-        self.amount_total_signed = self.amount_total * sign
+            invoice.amount_without_wh_tax = invoice.amount_untaxed + invoice.amount_tax
+            invoice.amount_total = invoice.amount_without_wh_tax - invoice.wh_taxes
+            sign = invoice.type in ['in_refund', 'out_refund'] and -1 or 1
+            invoice.amount_total_signed = invoice.amount_total * sign
 
-    @api.one
+    @api.multi
     @api.depends(
         'state', 'currency_id', 'invoice_line_ids.price_subtotal',
         'move_id.line_ids.amount_residual',
         'move_id.line_ids.currency_id')
+    @instrumented('account.invoice._compute_residual')
     def _compute_residual(self):
-        fp_company = self.env['account.fiscal.position'].search(
-            [('id', '=', self.company_id.partner_id.property_account_position_id.id)])
-        company_tax_ids = [base_tax.tax_id.id for base_tax in fp_company.tax_ids_invoice]
-
-        residual = 0.0
-        residual_company_signed = 0.0
-        sign = self.type in ['in_refund', 'out_refund'] and -1 or 1
-        for line in self.sudo().move_id.line_ids:
-            if line.tax_line_id.id not in company_tax_ids:
-                if line.account_id.internal_type in ('receivable', 'payable'):
-                    residual_company_signed += line.amount_residual
-                    if line.currency_id == self.currency_id:
-                        residual += line.amount_residual_currency if line.currency_id else line.amount_residual
-                    else:
-                        from_currency = (line.currency_id and line.currency_id.with_context(
-                            date=line.date)) or line.company_id.currency_id.with_context(date=line.date)
-                        residual += from_currency.compute(line.amount_residual, self.currency_id)
-        self.residual_company_signed = abs(residual_company_signed) * sign
-        self.residual_signed = abs(residual) * sign
-        self.residual = abs(residual)
-        digits_rounding_precision = self.currency_id.rounding
-        if float_is_zero(self.residual, precision_rounding=digits_rounding_precision):
-            self.reconciled = True
-        else:
-            self.reconciled = False
+        get_wh_snapshot = self.env['res.company']._get_wh_snapshot
+        # Same company as res.currency.compute, the conversion rate is fetched once per currencies and date
+        company = self.env['res.company'].browse(self._context.get('company_id')) or \
+            self.env['res.users']._get_company()
+        rates = {}
+
+        # Prefetch the move lines of all the invoices at once
+        self.sudo().mapped('move_id.line_ids.account_id')
+
+        for invoice in self:
+            company_tax_ids = get_wh_snapshot(invoice.company_id.id).tax_ids
+
+            residual = 0.0
+            residual_company_signed = 0.0
+            sign = invoice.type in ['in_refund', 'out_refund'] and -1 or 1
+            for line in invoice.sudo().move_id.line_ids:
+                if line.tax_line_id.id not in company_tax_ids:
+                    if line.account_id.internal_type in ('receivable', 'payable'):
+                        residual_company_signed += line.amount_residual
+                        if line.currency_id == invoice.currency_id:
+                            residual += line.amount_residual_currency if line.currency_id else line.amount_residual
+                        else:
+                            from_currency = line.currency_id or line.company_id.currency_id
+                            key = (from_currency.id, invoice.currency_id.id, line.date)
+                            if key not in rates:
+                                rates[key] = 1.0 if from_currency == invoice.currency_id else \
+                                    from_currency._get_conversion_rate(from_currency, invoice.currency_id, company,
+                                                                       line.date)
+                            residual += invoice.currency_id.round(line.amount_residual * rates[key])
+            invoice.residual_company_signed = abs(residual_company_signed) * sign
+            invoice.residual_signed = abs(residual) * sign
+            invoice.residual = abs(residual)
+            digits_rounding_precision = invoice.currency_id.rounding
+            if float_is_zero(invoice.residual, precision_rounding=digits_rounding_precision):
+                invoice.reconciled = True
+            else:
+                invoice.reconciled = False
 
     @api.multi
     def _get_tax_amount_by_group(self):
         self.ensure_one()
-        res = {}
-        currency = self.currency_id or self.company_id.currency_id
-        for line in self.tax_line_ids:
-            if not line.tax_id.dont_impact_balance:
-                res.setdefault(line.tax_id.tax_group_id, 0.0)
-                res[line.tax_id.tax_group_id] += line.amount
-
-        res = sorted(res.items(), key=lambda l: l[0].sequence)
-        res = map(lambda l: (l[0].name, formatLang(self.env, l[1], currency_obj=currency)), res)
-
-        groups_not_in_invoice = self.env['account.tax.group'].search_read([('not_in_invoice', '=', True)], ['name'])
-
-        for g in groups_not_in_invoice:
-            for i in res:
-                if g['name'] == i[0]:
-                    res.remove(i)
-        return res
-
-    def at_least_one_tax_group_enabled(self):
-        res = False
-        groups = self.env['account.tax'].search_read(
-            [('id', 'in', [invoice_tax.tax_id.id for invoice_tax in self.tax_line_ids])], ['tax_group_id'])
-
-        in_invoice = set()
-        for group in groups:
-            in_invoice.add(group['tax_group_id'][0])
-        in_invoice = list(in_invoice)
+        return self._get_tax_amount_by_group_batch()[self.id]
 
-        dont_show = [i.id for i in self.env['account.tax.group'].search([('not_in_invoice', '=', True),
-                                                                         ('id', 'in', in_invoice)])]
-        if len(dont_show) < len(in_invoice):
-            res = True
+    @api.multi
+    def _get_tax_amount_by_group_batch(self):
+        """
+        Computes the tax amounts grouped by tax group of every invoice of the recordset, without the
+        taxes that don't impact balance nor the groups hidden in invoices
+        @return: dict mapping an invoice id to a list of (group name, formatted amount)
+        """
+        hidden_group_ids = self.env['account.tax.group']._get_hidden_group_ids()
+        self.mapped('tax_line_ids.tax_id.tax_group_id')
+
+        result = {}
+        for invoice in self:
+            res = {}
+            currency = invoice.currency_id or invoice.company_id.currency_id
+            for line in invoice.tax_line_ids:
+                group = line.tax_id.tax_group_id
+                if not line.tax_id.dont_impact_balance and group.id not in hidden_group_ids:
+                    res.setdefault(group, 0.0)
+                    res[group] += line.amount
+
+            res = sorted(res.items(), key=lambda l: l[0].sequence)
+            result[invoice.id] = [(group.name, formatLang(self.env, amount, currency_obj=currency))
+                                  for group, amount in res]
+        return result
 
-        return res
+    @api.multi
+    def at_least_one_tax_group_enabled(self):
+        hidden_group_ids = self.env['account.tax.group']._get_hidden_group_ids()
+        in_invoice = set(self.mapped('tax_line_ids.tax_id.tax_group_id').ids)
+        return bool(in_invoice - hidden_group_ids)
 
     @api.onchange('payment_term_id', 'date_invoice')
     def _onchange_payment_term_date_invoice(self):
@@ -174,181 +211,355 @@ class AccountInvoice(models.Model):
     def _onchange_partner_id(self):
         # self.date_invoice = fields.Date.context_today(self)
         res = super(AccountInvoice, self)._onchange_partner_id()
-        self._onchange_invoice_line_ids()
+        self._onchange_tax_lines()
         return res
 
+    def _is_wh_onchange_preview(self):
+        if 'wh_onchange_preview' in self._context:
+            return bool(self._context['wh_onchange_preview'])
+        return self.env['ir.config_parameter'].sudo().get_param(
+            'l10n_co_tax_extension.onchange_preview') in ('1', 'True', 'true')
+
+    def _onchange_tax_lines(self):
+        """ Refreshes the tax lines after a change of partner, fiscal position or date. In preview mode only the
+        withholding tax lines are replaced, from the cached configuration, and the full regeneration of the tax
+        lines is deferred to the save or the validation of the invoice """
+        if not self._is_wh_onchange_preview():
+            self._onchange_invoice_line_ids()
+            return
+
+        wh_tax_ids = self.env['account.fiscal.position']._get_all_wh_tax_ids()
+        tax_lines = self.tax_line_ids.filtered(lambda line: line.manual or line.tax_id.id not in wh_tax_ids)
+        for tax in self._merge_wh_tax_values({}).values():
+            tax_lines += tax_lines.new(tax)
+        self.tax_line_ids = tax_lines
+        self.wh_taxes_pending = True
+
+    @api.multi
+    def _recompute_withholding(self):
+        """ Regenerates the tax lines of the draft invoices and recomputes the stored amounts, withholding and
+        residual of all of them """
+        self.filtered(lambda inv: inv.state == 'draft').compute_taxes()
+        for field in self._fields.values():
+            if field.store and field.compute in ('_compute_amount', '_compute_residual'):
+                self.env.add_todo(field, self)
+        self.recompute()
+
+    @api.multi
+    def _compute_pending_wh_taxes(self):
+        invoices = self.filtered(lambda inv: inv.state == 'draft' and inv.wh_taxes_pending)
+        if invoices:
+            invoices.compute_taxes()
+            invoices.write({'wh_taxes_pending': False})
+
+    @api.model
+    def create(self, vals):
+        invoice = super(AccountInvoice, self).create(vals)
+        invoice._compute_pending_wh_taxes()
+        return invoice
+
+    @api.multi
+    def write(self, vals):
+        res = super(AccountInvoice, self).write(vals)
+        if vals.get('wh_taxes_pending'):
+            self._compute_pending_wh_taxes()
+        if vals.get('state') in ('open', 'cancel', 'draft'):
+            # Validation, cancellation and reset to draft change the withholding summary of the invoices
+            self.env['account.withholding.summary'].sudo()._refresh_invoices(self)
+        return res
+
+    @api.multi
+    def action_invoice_open(self):
+        self._compute_pending_wh_taxes()
+        return super(AccountInvoice, self).action_invoice_open()
+
+    @api.multi
+    def _get_wh_group_inputs(self):
+        """
+        Returns the withholding configuration the invoice depends on besides its own values, shared by the
+        invoices of the same company and fiscal position: the company config, the partner config (None without
+        fiscal position), the ids of the inactive partner taxes and the threshold index
+        @return: tuple
+        """
+        self.ensure_one()
+        snapshot = self.env['res.company']._get_wh_snapshot(self.company_id.id)
+        partner_config = None
+        inactive_tax_ids = frozenset()
+        if self.fiscal_position_id:
+            partner_config = self.env['account.fiscal.position']._get_wh_tax_config(self.fiscal_position_id.id)
+            partner_taxes = self.env['account.tax'].browse(
+                [tax_id for tax_id in withholding_engine.filter_config(partner_config) if tax_id])
+            inactive_tax_ids = frozenset((partner_taxes - partner_taxes.filtered('active')).ids)
+        return snapshot.config, partner_config, inactive_tax_ids, self.env['account.base.tax']._get_threshold_index()
+
+    @api.multi
+    def _get_wh_tax_candidates(self, group_inputs=None):
+        """
+        Returns the withholding tax ids that apply to the invoice, from the company fiscal position
+        and from the partner fiscal position thresholds. A tax is repeated once per path it comes from.
+        group_inputs is the result of _get_wh_group_inputs, looked up when not given
+        @return: list
+        """
+        self.ensure_one()
+        company_config, partner_config, inactive_tax_ids, index = group_inputs or self._get_wh_group_inputs()
+        return withholding_engine.select_withholding_taxes(
+            company_config, partner_config, index, self.type, fields.Date.to_date(self.date_invoice),
+            self.amount_untaxed, journal_id=self.journal_id.id, wh_taxes=self.wh_taxes,
+            inactive_tax_ids=inactive_tax_ids)
+
+    @api.model
+    def _get_wh_engine(self):
+        """
+        Returns a withholding engine loaded with the current configuration of all the companies, for offline
+        simulations. Only 'percent' and 'fixed' taxes not included in the price can be evaluated by the engine
+        @return: withholding_engine.WithholdingEngine
+        """
+        position_model = self.env['account.fiscal.position']
+        companies = self.env['res.company'].sudo().search([])
+        company_positions = {company.id: self.env['res.company']._get_wh_snapshot(company.id).position_id
+                             for company in companies}
+        positions = {position.id: position_model._get_wh_tax_config(position.id)
+                     for position in position_model.sudo().search([])}
+        tax_ids = {tax_id for config in positions.values() for tax_id in withholding_engine.filter_config(config)
+                   if tax_id}
+        taxes = self.env['account.tax'].sudo().with_context(active_test=False).browse(tax_ids).exists()
+        return withholding_engine.WithholdingEngine(
+            company_positions, positions, self.env['account.base.tax']._get_threshold_index(),
+            {tax.id: (tax.amount_type, tax.amount, tax.price_include) for tax in taxes},
+            inactive_tax_ids=frozenset(taxes.filtered(lambda tax: not tax.active).ids))
+
+    @api.model
+    def simulate_withholding(self, rows):
+        """
+        Evaluates the withholding taxes of many invoices without creating them. Each row gives, in order, the
+        company id, fiscal position id, journal id, type, date, untaxed amount and withheld amount (only used
+        for refunds) of an invoice, optionally followed by its currency id, the company currency by default.
+        Raises ValueError when a tax can't be evaluated by the engine
+        @return: list of lists of (tax_id, base, amount)
+        """
+        roundings = {}
+
+        def get_rounding(company_id, currency_id):
+            # Same precision as compute_all, which doesn't round the taxes when they are rounded globally
+            if (company_id, currency_id) not in roundings:
+                company = self.env['res.company'].sudo().browse(company_id)
+                currency = self.env['res.currency'].browse(currency_id) or company.currency_id
+                rounding = currency.rounding
+                if company.tax_calculation_rounding_method == 'round_globally':
+                    rounding *= 1e-5
+                roundings[company_id, currency_id] = rounding
+            return roundings[company_id, currency_id]
+
+        return self._get_wh_engine().evaluate_batch(
+            withholding_engine.WithholdingInput(row[0], row[1], row[2], row[3], fields.Date.to_date(row[4]), row[5],
+                                                row[6], get_rounding(row[0], row[7] if len(row) > 7 else False))
+            for row in rows)
+
     @api.multi
+    def _prepare_wh_tax_line_vals(self, tax):
+        """
+        Prepares the values of the invoice tax line of a withholding tax computed on the untaxed amount
+        @return: dict
+        """
+        self.ensure_one()
+        tax_vals = tax.with_context(skip_counterpart_accounts=True).compute_all(
+            self.amount_untaxed, self.currency_id, partner=self.partner_id)['taxes'][0]
+        return {
+            'invoice_id': self.id,
+            'name': tax_vals['name'],
+            'tax_id': tax_vals['id'],
+            'amount': tax_vals['amount'],
+            'base': tax_vals['base'],
+            'manual': False,
+            'sequence': tax_vals['sequence'],
+            'account_analytic_id': tax_vals['analytic'] or False,
+            'account_id': self.type in ('out_invoice', 'in_invoice') and tax_vals['account_id'] or tax_vals[
+                'refund_account_id'],
+        }
+
+    @api.multi
+    @instrumented('account.invoice.get_taxes_values')
     def get_taxes_values(self):
         tax_grouped = super(AccountInvoice, self).get_taxes_values()
+        for invoice in self:
+            invoice._merge_wh_tax_values(tax_grouped)
+        return tax_grouped
 
-        for order in self:
-            tipo_factura = 'sale'
-            if order.type in ('in_invoice', 'in_refund'):
-                tipo_factura = 'purchase'
-            if order.company_id.partner_id.property_account_position_id:
-
-                fp = self.env['account.fiscal.position'].search(
-                    [('id', '=', self.env.user.company_id.partner_id.property_account_position_id.id)])
-                fp.ensure_one()
-
-                for taxs in fp.tax_ids_invoice:
-                    sql_diarios = "Select * from account_journal_taxes_ids_rel where tax_id = " + str(taxs.id) + ""
-                    self.env.cr.execute(sql_diarios)
-                    records = self.env.cr.dictfetchall()
-                    if not records:
-                        tax_ids = self.env['account.tax'].browse(taxs.tax_id.id)
-                        for tax_id in tax_ids:
-                            if tax_id.type_tax_use == tipo_factura:
-                                tax = \
-                                    tax_id.compute_all(self.amount_untaxed, self.currency_id, partner=self.partner_id)[
-                                        'taxes'][0]
-
-                                val = {
-                                    'invoice_id': self.id,
-                                    'name': tax['name'],
-                                    'tax_id': tax['id'],
-                                    'amount': tax['amount'],
-                                    'base': tax['base'],
-                                    'manual': False,
-                                    'sequence': tax['sequence'],
-                                    'account_analytic_id': tax['analytic'] or False,
-                                    'account_id': self.type in ('out_invoice', 'in_invoice') and tax['account_id'] or
-                                                  tax['refund_account_id'],
-                                }
-
-                                key = self.env['account.tax'].browse(tax['id']).get_grouping_key(val)
-
-                                if key not in tax_grouped:
-                                    tax_grouped[key] = val
-                                else:
-                                    tax_grouped[key]['amount'] += val['amount']
-                                    tax_grouped[key]['base'] += val['base']
-                    if records:
-
-                        for loc in records:
-
-                            if loc.get('journal_id') == order.journal_id.id:
-                                ql_tax_id = "Select tax_id from account_fiscal_position_base_tax slt where id = " + str(
-                                    loc.get('tax_id')) + ""
-                                self.env.cr.execute(ql_tax_id)
-                                records_tax = self.env.cr.dictfetchall()
-                                fp_tax_ids = [tax.get('tax_id') for tax in records_tax]
-                                tax_ids = self.env['account.tax'].browse(fp_tax_ids)
-                                for tax_id in tax_ids:
-                                    if tax_id.type_tax_use == tipo_factura:
-                                        tax = tax_id.compute_all(self.amount_untaxed, self.currency_id,
-                                                                 partner=self.partner_id)['taxes'][0]
-                                        val = {
-                                            'invoice_id': self.id,
-                                            'name': tax['name'],
-                                            'tax_id': tax['id'],
-                                            'amount': tax['amount'],
-                                            'base': tax['base'],
-                                            'manual': False,
-                                            'sequence': tax['sequence'],
-                                            'account_analytic_id': tax['analytic'] or False,
-                                            'account_id': self.type in ('out_invoice', 'in_invoice') and tax[
-                                                'account_id'] or tax['refund_account_id'],
-                                        }
-
-                                        key = self.env['account.tax'].browse(tax['id']).get_grouping_key(val)
-
-                                        if key not in tax_grouped:
-                                            tax_grouped[key] = val
-                                        else:
-                                            tax_grouped[key]['amount'] += val['amount']
-                                            tax_grouped[key]['base'] += val['base']
-
-            if self.fiscal_position_id:
-                fp = self.env['account.fiscal.position'].search([('id', '=', self.fiscal_position_id.id)])
-                fp.ensure_one()
-
-                type_tax = 'sale' if self.type in ('out_invoice', 'out_refund') else 'purchase'
-                tax_ids = self.env['account.tax'].search([('id', 'in', [tax.tax_id.id for tax in fp.tax_ids_invoice]),
-                                                          ('type_tax_use', '=', type_tax),
-                                                          ('base_taxes', '>', 0)])
-
-                tax_ids = [tax.id for tax in tax_ids]
-
-                base_taxes = []
-                if self.type in ('in_refund', 'out_refund') and self.wh_taxes:
-                    base_taxes = self.env['account.base.tax'].search([('start_date', '<=', self.date_invoice),
-                                                                      ('end_date', '>=', self.date_invoice),
-                                                                      # ('amount', '<=', self.amount_untaxed),
-                                                                      ('tax_id', 'in', tax_ids)])
-                else:
-                    base_taxes = self.env['account.base.tax'].search([('start_date', '<=', self.date_invoice),
-                                                                      ('end_date', '>=', self.date_invoice),
-                                                                      ('amount', '<=', self.amount_untaxed),
-                                                                      ('tax_id', 'in', tax_ids)])
-
-                for base in base_taxes:
-                    tax = \
-                        base.tax_id.compute_all(self.amount_untaxed, self.currency_id, partner=self.partner_id)[
-                            'taxes'][0]
-                    val = {
-                        'invoice_id': self.id,
-                        'name': tax['name'],
-                        'tax_id': tax['id'],
-                        'amount': tax['amount'],
-                        'base': tax['base'],
-                        'manual': False,
-                        'sequence': tax['sequence'],
-                        'account_analytic_id': tax['analytic'] or False,
-                        'account_id': self.type in ('out_invoice', 'in_invoice') and tax['account_id'] or tax[
-                            'refund_account_id'],
-                    }
-
-                    key = self.env['account.tax'].browse(tax['id']).get_grouping_key(val)
-
-                    if key not in tax_grouped:
-                        tax_grouped[key] = val
-                    else:
-                        tax_grouped[key]['amount'] += val['amount']
-                        tax_grouped[key]['base'] += val['base']
+    @api.multi
+    def _merge_wh_tax_values(self, tax_grouped, group_inputs=None):
+        """
+        Adds the withholding tax lines of the invoice to tax_grouped. Every withholding tax is computed once,
+        then merged once per path it comes from
+        @return: tax_grouped
+        """
+        self.ensure_one()
+        for key, val in self._get_wh_tax_values(self._get_wh_fingerprint(), group_inputs=group_inputs):
+            if key not in tax_grouped:
+                tax_grouped[key] = dict(val, invoice_id=self.id)
+            else:
+                tax_grouped[key]['amount'] += val['amount']
+                tax_grouped[key]['base'] += val['base']
 
         return tax_grouped
 
+    @api.multi
+    def _get_wh_fingerprint(self):
+        """
+        Returns the values of the invoice the withholding tax lines depend on, with the language of the tax names
+        and the rounding of the amounts. The configuration is not part of it: the memoized results are dropped
+        with the registry caches whenever account.fiscal.position.base.tax, account.base.tax or account.tax change
+        @return: tuple
+        """
+        self.ensure_one()
+        return (self.company_id.id, self.amount_untaxed, self.currency_id.id, fields.Date.to_date(self.date_invoice),
+                self.fiscal_position_id.id, self.journal_id.id, self.type, self.partner_id.id, self.env.lang,
+                self.company_id.tax_calculation_rounding_method, self.currency_id.rounding,
+                self.type in ('in_refund', 'out_refund') and bool(self.wh_taxes))
+
     @api.model
+    @tools.ormcache()
+    def _get_wh_cache_token(self):
+        """
+        Returns a token renewed whenever the registry caches are cleared, in this worker or in another one,
+        so the withholding tax lines memoized before a configuration change are no longer used
+        @return: int
+        """
+        return next(_wh_cache_tokens)
+
+    @api.multi
+    def _get_wh_tax_values(self, fingerprint, group_inputs=None):
+        """
+        Returns the withholding tax lines of the invoice as a tuple of (grouping key, values without invoice_id),
+        one entry per path a tax comes from. Every withholding tax is computed once, and the result is memoized
+        in a bounded cache of the module on the fingerprint of the invoice, so invoices with the same inputs
+        share it
+        @return: tuple
+        """
+        self.ensure_one()
+        memo_key = (self.env.cr.dbname, self._get_wh_cache_token(), fingerprint)
+        result = _wh_tax_values_memo.get(memo_key)
+        if result is not None:
+            return result
+
+        computed = {}
+        result = []
+        for tax in self.env['account.tax'].browse(self._get_wh_tax_candidates(group_inputs)):
+            if tax.id not in computed:
+                val = self._prepare_wh_tax_line_vals(tax)
+                del val['invoice_id']
+                computed[tax.id] = (self.env['account.tax'].browse(val['tax_id']).get_grouping_key(val), val)
+            result.append(computed[tax.id])
+        result = _wh_tax_values_memo[memo_key] = tuple(result)
+        return result
+
+    @api.model
+    @instrumented('account.invoice.tax_line_move_line_get')
     def tax_line_move_line_get(self):
         result = super(AccountInvoice, self).tax_line_move_line_get()
 
         if self.type in ('out_invoice', 'out_refund'):
-            fp = self.env['account.fiscal.position'].search(
-                [('id', '=', self.company_id.partner_id.property_account_position_id.id)])
-            # fp.ensure_one()
-
-            tax_ids = self.env['account.tax'].search([('id', 'in', [tax.tax_id.id for tax in fp.tax_ids_invoice]),
-                                                      ('type_tax_use', '=', 'sale'),
-                                                      ('dont_impact_balance', '=', True)])
-            tax_ids = [tax.id for tax in tax_ids]
+            counterpart_tax_ids = self.env['res.company']._get_wh_snapshot(self.company_id.id).counterpart_tax_ids
+            tax_lines = self.tax_line_ids.filtered(lambda line: line.tax_id.id in counterpart_tax_ids)
+
+            # The counterpart accounts are checked once per tax, not per tax line
+            if any(not (tax.account_id_counterpart and tax.refund_account_id_counterpart)
+                   for tax in tax_lines.mapped('tax_id')):
+                raise UserError(_('You have not a counterpart account on one of your company taxes'))
+
             done_taxes = []
-            for tax_line in sorted(self.tax_line_ids, key=lambda x: -x.sequence):
-                if tax_line.tax_id.id in tax_ids:
-                    if tax_line.tax_id.account_id_counterpart and tax_line.tax_id.refund_account_id_counterpart:
-                        done_taxes.append(tax_line.tax_id.id)
-                        result.append({
-                            'invoice_tax_line_id': tax_line.id,
-                            'tax_line_id': tax_line.tax_id.id,
-                            'type': 'tax',
-                            'name': tax_line.name,
-                            'price_unit': tax_line.amount,
-                            'quantity': 1,
-                            'price': tax_line.amount * -1,
-                            'account_id': tax_line.tax_id.account_id_counterpart.id,
-                            'account_analytic_id': tax_line.account_analytic_id.id,
-                            'invoice_id': self.id,
-                            'tax_ids': [(6, 0, done_taxes)] if tax_line.tax_id.include_base_amount else []
-                        })
-                    else:
-                        raise UserError(_('You have not a counterpart account on one of your company taxes'))
+            for tax_line in sorted(tax_lines, key=lambda x: -x.sequence):
+                done_taxes.append(tax_line.tax_id.id)
+                result.append({
+                    'invoice_tax_line_id': tax_line.id,
+                    'tax_line_id': tax_line.tax_id.id,
+                    'type': 'tax',
+                    'name': tax_line.name,
+                    'price_unit': tax_line.amount,
+                    'quantity': 1,
+                    'price': tax_line.amount * -1,
+                    'account_id': tax_line.tax_id.account_id_counterpart.id,
+                    'account_analytic_id': tax_line.account_analytic_id.id,
+                    'invoice_id': self.id,
+                    # Each command gets its own copy of the taxes done so far, like the core move lines
+                    'tax_ids': [(6, 0, list(done_taxes))] if tax_line.tax_id.include_base_amount else []
+                })
         return result
 
+    @api.multi
+    def add_product_lines(self, lines):
+        """
+        Adds lines to a draft invoice from a list of dicts with a product_id and optionally a quantity,
+        a price_unit or any other line value. The values derived from a product are computed once per
+        product and shared by its lines, then the lines are created in one batch and the taxes recomputed
+        @return: account.invoice.line recordset
+        """
+        self.ensure_one()
+        if self.state != 'draft':
+            raise UserError(_('Lines can only be added to draft invoices.'))
+        if not self.partner_id:
+            raise UserError(_('You must first select a partner.'))
+        memo = {}
+        line_model = self.env['account.invoice.line']
+        vals_list = []
+        for line_vals in lines:
+            line = line_model.new({'invoice_id': self.id, 'product_id': line_vals['product_id'],
+                                   'quantity': line_vals.get('quantity', 1.0)})
+            line._apply_product_values(memo)
+            vals = line._convert_to_write({name: line[name] for name in line._cache})
+            vals.update(line_vals)
+            vals['invoice_id'] = self.id
+            vals_list.append(vals)
+
+        invoice_lines = line_model.create(vals_list)
+        self.compute_taxes()
+        return invoice_lines
+
+    @api.multi
+    def action_invoice_open_batch(self):
+        """
+        Validates the draft invoices grouped by company, fiscal position, journal, type and date. The withholding
+        configuration and thresholds of each group are looked up once, the tax lines of all the invoices of the
+        group are generated from them, then the invoices are validated together. Other invoices are ignored
+        @return: True
+        """
+        invoices = self.filtered(lambda inv: inv.state == 'draft')
+        groups = OrderedDict()
+        for invoice in invoices:
+            key = (invoice.company_id.id, invoice.fiscal_position_id.id, invoice.journal_id.id, invoice.type,
+                   invoice.date_invoice)
+            groups[key] = groups.get(key, self.browse()) | invoice
+
+        for group in groups.values():
+            group._compute_taxes_wh_group()
+        if invoices:
+            invoices.action_invoice_open()
+        return True
+
+    @api.multi
+    def _compute_taxes_wh_group(self):
+        """
+        Same as compute_taxes for invoices sharing company, fiscal position, journal, type and date, with their
+        withholding configuration looked up once for all of them
+        @return: True
+        """
+        group_inputs = self[:1]._get_wh_group_inputs()
+        tax_model = self.env['account.invoice.tax']
+        for invoice in self:
+            self._cr.execute("DELETE FROM account_invoice_tax WHERE invoice_id=%s AND manual is False", (invoice.id,))
+            if self._cr.rowcount:
+                self.invalidate_cache()
+            tax_grouped = super(AccountInvoice, invoice).get_taxes_values()
+            invoice._merge_wh_tax_values(tax_grouped, group_inputs)
+            for tax in tax_grouped.values():
+                tax_model.create(tax)
+        # Also triggers the recompute of the amounts, like the dummy write of compute_taxes
+        return self.write({'invoice_line_ids': [], 'wh_taxes_pending': False})
+
     @api.onchange('fiscal_position_id', 'date_invoice')
     def _onchange_fiscal_position_id(self):
         if not self.date_invoice:
             self.date_invoice = fields.Date.context_today(self)
-        self._onchange_invoice_line_ids()
+        self._onchange_tax_lines()
 
 
 class AccountInvoiceLine(models.Model):
@@ -357,6 +568,14 @@ class AccountInvoiceLine(models.Model):
 
     @api.onchange('product_id')
     def _onchange_product_id(self):
+        return self._apply_product_values({})
+
+    def _apply_product_values(self, memo):
+        """
+        Sets the account, taxes, price, name and unit of measure of the line from its product. The values that
+        only depend on the product and the invoice are kept in memo, so lines of the same product reuse them
+        @return: dict with the domain or the warning of the onchange
+        """
         domain = {}
         if not self.invoice_id:
             return
@@ -384,12 +603,26 @@ class AccountInvoiceLine(models.Model):
                 self_lang = self.with_context(lang=part.lang)
 
             product = self_lang.product_id
-            account = self.get_invoice_line_account(type, product, fpos, company)
+            account_key = ('account', product.id, fpos.id, company.id, type)
+            if account_key not in memo:
+                memo[account_key] = self.get_invoice_line_account(type, product, fpos, company)
+            account = memo[account_key]
             if account:
                 self.account_id = account.id
-            self._set_taxes()
 
-            product_name = self_lang._get_invoice_line_name_from_product()
+            taxes_key = ('taxes', product.id, fpos.id, company.id, part.id, type, currency.id,
+                         self.invoice_id.date_invoice, self.account_id.id,
+                         self.price_unit if type in ('in_invoice', 'in_refund') else None)
+            if taxes_key in memo:
+                self.invoice_line_tax_ids, self.price_unit = memo[taxes_key]
+            else:
+                self._set_taxes()
+                memo[taxes_key] = (self.invoice_line_tax_ids, self.price_unit)
+
+            name_key = ('name', product.id, part.lang, type)
+            if name_key not in memo:
+                memo[name_key] = self_lang._get_invoice_line_name_from_product()
+            product_name = memo[name_key]
             if product_name != None:
                 self.name = product_name
 
@@ -424,20 +657,41 @@ class AccountTax(models.Model):
     position_id = fields.Many2one('account.fiscal.position', string='Fiscal position related id')
     base_taxes = fields.One2many('account.base.tax', 'tax_id', string='Base taxes',
                                  help='This field show related taxes applied to this tax')
+    uvt_base = fields.Float(string="Base in UVT", digits=0, default=0,
+                            help="Number of UVT of the base of this tax, used to create the yearly base taxes")
+
+    @api.multi
+    def write(self, vals):
+        # The withholding configuration and the cached withholding tax lines depend on the taxes
+        self.clear_caches()
+        return super(AccountTax, self).write(vals)
+
+    @api.multi
+    def unlink(self):
+        # The cached configuration and withholding tax lines must not keep the ids of deleted taxes
+        self.clear_caches()
+        return super(AccountTax, self).unlink()
 
     @api.onchange('account_id_counterpart')
     def onchange_account_id_counterpart(self):
         self.refund_account_id_counterpart = self.account_id_counterpart
 
     @api.v8
+    @instrumented('account.tax.compute_all')
     def compute_all(self, price_unit, currency=None, quantity=1.0, product=None, partner=None):
         result = super(AccountTax, self).compute_all(price_unit, currency=currency, quantity=quantity, product=product,
                                                      partner=partner)
-        for tax in self.sorted(key=lambda r: r.sequence):
-            for iter_tax in result['taxes']:
-                if iter_tax['id'] == tax.id:
-                    iter_tax['account_id_counterpart'] = tax.account_id_counterpart.id
-                    iter_tax['refund_account_id_counterpart'] = tax.refund_account_id_counterpart.id
+        # Callers that don't read the counterpart accounts can skip the enrichment with this context
+        # key, it is then only done when one of the taxes doesn't impact balance
+        if self._context.get('skip_counterpart_accounts') and not any(tax.dont_impact_balance for tax in self):
+            return result
+
+        taxes_by_id = {tax.id: tax for tax in self}
+        for iter_tax in result['taxes']:
+            tax = taxes_by_id.get(iter_tax['id'])
+            if tax:
+                iter_tax['account_id_counterpart'] = tax.account_id_counterpart.id
+                iter_tax['refund_account_id_counterpart'] = tax.refund_account_id_counterpart.id
 
         return result
 
@@ -452,21 +706,182 @@ class AccountBaseTax(models.Model):
 
     # currency_id = fields.Many2one('res.currency', related='tax_id.company_id.currency_id', store=True)
 
-    @api.one
+    @api.model_cr
+    def init(self):
+        """ Thresholds are always looked up by tax and date range """
+        self._cr.execute('SELECT indexname FROM pg_indexes WHERE indexname = %s',
+                         ('account_base_tax_tax_id_dates_idx',))
+        if not self._cr.fetchone():
+            self._cr.execute('CREATE INDEX account_base_tax_tax_id_dates_idx '
+                             'ON account_base_tax (tax_id, start_date, end_date)')
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        self.clear_caches()
+        res = super(AccountBaseTax, self).create(vals_list)
+        res._enqueue_recompute()
+        return res
+
+    @api.multi
+    def write(self, vals):
+        self.clear_caches()
+        # One job covers both the taxes and dates before the write and the ones after it
+        scope = self._get_recompute_scope()
+        res = super(AccountBaseTax, self).write(vals)
+        self._enqueue_recompute(scope)
+        return res
+
+    @api.multi
+    def unlink(self):
+        self.clear_caches()
+        self._enqueue_recompute()
+        return super(AccountBaseTax, self).unlink()
+
+    @api.multi
+    def _get_recompute_scope(self):
+        """
+        Returns the taxes and the date range of these base taxes
+        @return: (account.tax recordset, date_from, date_to)
+        """
+        if not self:
+            return self.env['account.tax'], False, False
+        return self.mapped('tax_id'), min(self.mapped('start_date')), max(self.mapped('end_date'))
+
+    @api.multi
+    def _enqueue_recompute(self, scope=None):
+        """
+        Enqueues the recompute of the draft invoices whose withholding taxes may depend on these base taxes,
+        and on the taxes and date range of scope when given
+        """
+        taxes, date_from, date_to = self._get_recompute_scope()
+        if scope and scope[0]:
+            taxes |= scope[0]
+            date_from = min(date_from or scope[1], scope[1])
+            date_to = max(date_to or scope[2], scope[2])
+        if not taxes:
+            return
+        positions = self.env['account.fiscal.position.base.tax'].sudo().search(
+            [('tax_id', 'in', taxes.ids)]).mapped('position_id')
+        self.env['account.withholding.recompute']._enqueue(positions, _('Base taxes changed'),
+                                                           date_from=date_from, date_to=date_to)
+
+    @api.model
+    def create_uvt_thresholds(self, uvt_value, multipliers, start_date, end_date):
+        """
+        Creates in one batch the base taxes of a period from the UVT value, multipliers maps a tax id
+        to its base in UVT. Overlaps with existing base taxes are validated once for the whole batch
+        @return: account.base.tax recordset
+        """
+        taxes = self.env['account.tax'].browse(list(multipliers))
+        vals_list = [{
+            'tax_id': tax.id,
+            'start_date': start_date,
+            'end_date': end_date,
+            'amount': tax.company_id.currency_id.round(uvt_value * multipliers[tax.id]),
+        } for tax in taxes]
+        return self.create(vals_list)
+
+    @api.model
+    def import_thresholds_csv(self, data):
+        """
+        Creates in one batch the base taxes described by a CSV text with the columns tax_id, start_date,
+        end_date and amount. The tax_id column accepts the database id or the name of a tax of the company of
+        the user
+        @return: account.base.tax recordset
+        """
+        rows = list(csv.DictReader(io.StringIO(data)))
+        missing = {'tax_id', 'start_date', 'end_date', 'amount'} - set(rows and rows[0] or ())
+        if rows and missing:
+            raise UserError(_('Missing columns in the CSV file: %s') % ', '.join(sorted(missing)))
+
+        company = self.env.user.company_id
+        refs = {(row['tax_id'] or '').strip() for row in rows}
+        names = {ref for ref in refs if not ref.isdigit()}
+        tax_ids_by_name = {}
+        for tax in self.env['account.tax'].search([('name', 'in', list(names)), ('company_id', '=', company.id)]):
+            tax_ids_by_name.setdefault(tax.name, []).append(tax.id)
+        company_tax_ids = set(self.env['account.tax'].with_context(active_test=False).browse(
+            [int(ref) for ref in refs if ref.isdigit()]).exists().filtered(lambda tax: tax.company_id == company).ids)
+
+        vals_list = []
+        for line, row in enumerate(rows, 2):
+            empty = [name for name in ('tax_id', 'start_date', 'end_date', 'amount') if not (row[name] or '').strip()]
+            if empty:
+                raise UserError(_('Line %s: missing value for %s') % (line, ', '.join(empty)))
+            tax_ref = row['tax_id'].strip()
+            if tax_ref.isdigit():
+                tax_id = int(tax_ref)
+                if tax_id not in company_tax_ids:
+                    raise UserError(_('Line %s: no tax with id %s in the company %s') % (line, tax_id, company.name))
+            elif len(tax_ids_by_name.get(tax_ref, [])) == 1:
+                tax_id = tax_ids_by_name[tax_ref][0]
+            else:
+                raise UserError(_('Line %s: no single tax matches "%s"') % (line, tax_ref))
+            vals = {'tax_id': tax_id}
+            for name in ('start_date', 'end_date'):
+                try:
+                    vals[name] = fields.Date.to_date(row[name].strip())
+                except ValueError:
+                    raise UserError(_('Line %s: invalid date "%s" in column %s') % (line, row[name].strip(), name))
+            try:
+                vals['amount'] = float(row['amount'])
+            except ValueError:
+                raise UserError(_('Line %s: invalid amount "%s"') % (line, row['amount'].strip()))
+            vals_list.append(vals)
+        return self.create(vals_list)
+
+    @api.model
+    @tools.ormcache()
+    def _get_threshold_index(self):
+        """
+        Returns the thresholds of every tax, loaded with a single query, as a dict mapping a tax id
+        to a (start_dates, thresholds) pair where thresholds is a tuple of
+        (start_date, end_date, amount, id) sorted by start date. The result is cached per registry
+        and invalidated on any change of account.base.tax
+        @return: dict
+        """
+        self.env.cr.execute("""
+            SELECT tax_id, start_date, end_date, amount, id
+              FROM account_base_tax
+             WHERE tax_id IS NOT NULL
+          ORDER BY tax_id, start_date, id
+        """)
+        return withholding_engine.build_threshold_index(self.env.cr.fetchall())
+
+    @api.model
+    def _get_applicable_tax_ids(self, tax_ids, date, amount=None):
+        """
+        Returns the ids of the taxes that have a threshold active at the given date and, when amount is
+        given, not greater than amount. A tax is returned once per matching threshold, in threshold order
+        @return: list
+        """
+        return withholding_engine.applicable_tax_ids(self._get_threshold_index(), tax_ids,
+                                                     fields.Date.to_date(date), amount=amount)
+
+    @api.multi
     @api.constrains('start_date', 'end_date')
     def _check_closing_date(self):
-        if self.start_date and self.end_date and self.end_date < self.start_date:
+        if any(base.start_date and base.end_date and base.end_date < base.start_date for base in self):
             raise ValidationError("Error! End date cannot be set before start date.")
 
     @api.multi
-    @api.constrains('start_date', 'end_date')
+    @api.constrains('tax_id', 'start_date', 'end_date')
     def _dont_overlap_date(self):
-        bases_ids = self.search([('start_date', '<=', self.end_date),
-                                 ('end_date', '>=', self.start_date),
-                                 ('tax_id', '=', self.tax_id.id),
-                                 ('id', '<>', self.id)])
-
-        if bases_ids:
+        # Checks the whole recordset against the table in one query, so bulk imports stay fast
+        if not self.ids:
+            return
+        self.env.cr.execute("""
+            SELECT base.id
+              FROM account_base_tax base
+              JOIN account_base_tax other ON other.tax_id IS NOT DISTINCT FROM base.tax_id
+                                         AND other.id <> base.id
+                                         AND other.start_date <= base.end_date
+                                         AND other.end_date >= base.start_date
+             WHERE base.id IN %s
+             LIMIT 1
+        """, (tuple(self.ids),))
+
+        if self.env.cr.fetchone():
             raise ValidationError("Error! cannot have overlap date range.")
 
 
@@ -477,6 +892,31 @@ class AccountTaxGroup(models.Model):
     not_in_invoice = fields.Boolean(string="Don't show in invoice", default=False,
                                     help="Check this if you want to hide the taxes in this group when print an invoice")
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        self.clear_caches()
+        return super(AccountTaxGroup, self).create(vals_list)
+
+    @api.multi
+    def write(self, vals):
+        if 'not_in_invoice' in vals:
+            self.clear_caches()
+        return super(AccountTaxGroup, self).write(vals)
+
+    @api.multi
+    def unlink(self):
+        self.clear_caches()
+        return super(AccountTaxGroup, self).unlink()
+
+    @api.model
+    @tools.ormcache()
+    def _get_hidden_group_ids(self):
+        """
+        Returns the ids of the tax groups hidden in invoices, cached per registry
+        @return: frozenset
+        """
+        return frozenset(self.sudo().search([('not_in_invoice', '=', True)]).ids)
+
 
 class AccountFiscalPositionTaxes(models.Model):
     _name = 'account.fiscal.position.base.tax'
@@ -491,13 +931,46 @@ class AccountFiscalPositionTaxes(models.Model):
     #     ('tax_fiscal_position_uniq', 'unique(position_id, tax_id)', _('Error! cannot have repeated taxes'))
     # ]
 
-    @api.constrains('tax_id')
-    def _check_dont_repeat_tax(self):
-        local_taxes = self.search([('position_id', '=', self.position_id.id),
-                                   ('tax_id', '=', self.tax_id.id),
-                                   ('id', '<>', self.id)])
+    @api.model_create_multi
+    def create(self, vals_list):
+        self.clear_caches()
+        res = super(AccountFiscalPositionTaxes, self).create(vals_list)
+        self.env['account.withholding.recompute']._enqueue(res.mapped('position_id'), _('Fiscal position taxes changed'))
+        return res
+
+    @api.multi
+    def write(self, vals):
+        self.clear_caches()
+        positions = self.mapped('position_id')
+        res = super(AccountFiscalPositionTaxes, self).write(vals)
+        self.env['account.withholding.recompute']._enqueue(positions | self.mapped('position_id'),
+                                                           _('Fiscal position taxes changed'))
+        return res
 
-        if local_taxes:
+    @api.multi
+    def unlink(self):
+        self.clear_caches()
+        self.env['account.withholding.recompute']._enqueue(self.mapped('position_id'),
+                                                           _('Fiscal position taxes changed'))
+        return super(AccountFiscalPositionTaxes, self).unlink()
+
+    @api.multi
+    @api.constrains('position_id', 'tax_id')
+    def _check_dont_repeat_tax(self):
+        # Checks the whole recordset against the table in one query, so bulk imports stay fast
+        if not self.ids:
+            return
+        self.env.cr.execute("""
+            SELECT base_tax.id
+              FROM account_fiscal_position_base_tax base_tax
+              JOIN account_fiscal_position_base_tax other ON other.position_id IS NOT DISTINCT FROM base_tax.position_id
+                                                         AND other.tax_id IS NOT DISTINCT FROM base_tax.tax_id
+                                                         AND other.id <> base_tax.id
+             WHERE base_tax.id IN %s
+             LIMIT 1
+        """, (tuple(self.ids),))
+
+        if self.env.cr.fetchone():
             raise ValidationError("Error! cannot have repeated taxes")
 
 
@@ -508,6 +981,184 @@ class AccountFiscalPosition(models.Model):
     tax_ids_invoice = fields.One2many('account.fiscal.position.base.tax', 'position_id',
                                       string='Taxes that refer to the fiscal position')
 
+    @api.multi
+    def write(self, vals):
+        if 'active' in vals or 'name' in vals:
+            self.clear_caches()
+        return super(AccountFiscalPosition, self).write(vals)
+
+    @api.model
+    def get_withholding_config(self, position_id, date=None):
+        """
+        Returns the compact withholding configuration of a fiscal position for clients and external
+        integrations, so they don't have to read tax_ids_invoice, its journals and the base taxes of every
+        tax. Each tax has its journal ids and thresholds, when date is given only the thresholds active at
+        that date are returned
+        @return: dict
+        """
+        self.check_access_rights('read')
+        self.browse(position_id).check_access_rule('read')
+        date = date and fields.Date.to_date(date)
+        name, taxes = self._get_wh_config_data(position_id)
+        return {
+            'id': position_id,
+            'name': name,
+            'taxes': [{
+                'tax_id': tax_id,
+                'name': tax_name,
+                'type_tax_use': type_tax_use,
+                'amount_type': amount_type,
+                'amount': amount,
+                'dont_impact_balance': dont_impact_balance,
+                'journal_ids': list(journal_ids),
+                'thresholds': [{
+                    'start_date': fields.Date.to_string(start_date),
+                    'end_date': fields.Date.to_string(end_date),
+                    'amount': threshold,
+                } for start_date, end_date, threshold in thresholds
+                    if not date or start_date <= date <= end_date],
+            } for tax_id, tax_name, type_tax_use, amount_type, amount, dont_impact_balance, journal_ids, thresholds
+                in taxes],
+        }
+
+    @api.model
+    @tools.ormcache('position_id', 'self.env.lang')
+    def _get_wh_config_data(self, position_id):
+        """
+        Returns the name of a fiscal position and one (tax_id, name, type_tax_use, amount_type, amount,
+        dont_impact_balance, journal_ids, thresholds) entry per withholding tax, built from the cached
+        configuration and threshold index. The result is cached per registry and language
+        @return: tuple
+        """
+        config = self._get_wh_tax_config(position_id)
+        index = self.env['account.base.tax']._get_threshold_index()
+        taxes = self.env['account.tax'].sudo().browse([tax_id for tax_id, tax_use, journal_ids in config if tax_id])
+        tax_values = {values['id']: values for values in
+                      taxes.read(['name', 'type_tax_use', 'amount_type', 'amount', 'dont_impact_balance'])}
+        entries = []
+        for tax_id, tax_use, journal_ids in config:
+            values = tax_values.get(tax_id)
+            if not values:
+                continue
+            thresholds = tuple((start_date, end_date, amount)
+                               for start_date, end_date, amount, base_id in index.get(tax_id, ((), ()))[1])
+            entries.append((tax_id, values['name'], values['type_tax_use'], values['amount_type'], values['amount'],
+                            values['dont_impact_balance'], tuple(sorted(journal_ids)), thresholds))
+        return self.sudo().browse(position_id).name or False, tuple(entries)
+
+    @api.model
+    @tools.ormcache('position_id')
+    def _get_wh_tax_config(self, position_id):
+        """
+        Returns the withholding configuration of a fiscal position as a tuple with one
+        (tax_id, type_tax_use, journal_ids) entry per line of tax_ids_invoice, loaded with a
+        single query. The result is cached per registry and invalidated on any change of
+        account.fiscal.position.base.tax
+        @return: tuple
+        """
+        if not position_id:
+            return ()
+        self.env.cr.execute("""
+            SELECT base_tax.tax_id, tax.type_tax_use,
+                   array_agg(rel.journal_id) FILTER (WHERE rel.journal_id IS NOT NULL)
+              FROM account_fiscal_position_base_tax base_tax
+              JOIN account_fiscal_position position ON position.id = base_tax.position_id
+         LEFT JOIN account_tax tax ON tax.id = base_tax.tax_id
+         LEFT JOIN account_journal_taxes_ids_rel rel ON rel.tax_id = base_tax.id
+             WHERE base_tax.position_id = %s AND position.active
+          GROUP BY base_tax.id, base_tax.tax_id, tax.type_tax_use
+          ORDER BY base_tax.id
+        """, (position_id,))
+        return tuple((tax_id or False, tax_use or False, frozenset(journal_ids or ()))
+                     for tax_id, tax_use, journal_ids in self.env.cr.fetchall())
+
+    @api.model
+    def _get_wh_tax_sequence(self, position_id, type_tax_use=None, journal_id=None):
+        """
+        Returns the withholding tax ids of a fiscal position in the order of its lines. When
+        type_tax_use is given only the taxes of that use are returned, when journal_id is given
+        only the taxes without journals or restricted to that journal are returned
+        @return: tuple
+        """
+        return withholding_engine.filter_config(self._get_wh_tax_config(position_id), type_tax_use=type_tax_use,
+                                                journal_id=journal_id)
+
+    @api.model
+    @tools.ormcache()
+    def _get_all_wh_tax_ids(self):
+        """
+        Returns the ids of the taxes used as withholding taxes in any fiscal position, cached per registry
+        @return: frozenset
+        """
+        self.env.cr.execute("SELECT DISTINCT tax_id FROM account_fiscal_position_base_tax WHERE tax_id IS NOT NULL")
+        return frozenset(row[0] for row in self.env.cr.fetchall())
+
+    @api.model
+    @tools.ormcache('position_id', 'type_tax_use')
+    def _get_counterpart_tax_ids(self, position_id, type_tax_use):
+        """
+        Returns the ids of the active withholding taxes of a fiscal position that don't impact balance,
+        and so get counterpart move lines, cached per registry
+        @return: frozenset
+        """
+        tax_ids = self._get_wh_tax_ids(position_id, type_tax_use=type_tax_use)
+        return frozenset(self.env['account.tax'].sudo().search([('id', 'in', list(tax_ids)),
+                                                                 ('dont_impact_balance', '=', True)]).ids)
+
+    @api.model
+    def _get_wh_tax_ids(self, position_id, type_tax_use=None, journal_id=None):
+        """
+        Same as _get_wh_tax_sequence, as a set
+        @return: frozenset
+        """
+        return frozenset(self._get_wh_tax_sequence(position_id, type_tax_use=type_tax_use, journal_id=journal_id))
+
+
+class ResCompany(models.Model):
+    _name = 'res.company'
+    _inherit = 'res.company'
+
+    @api.multi
+    def write(self, vals):
+        if 'partner_id' in vals:
+            self.clear_caches()
+        return super(ResCompany, self).write(vals)
+
+    @api.model
+    @tools.ormcache('company_id')
+    def _get_wh_snapshot(self, company_id):
+        """
+        Returns the withholding configuration of a company: its own fiscal position, read for that company
+        and not for the company of the user, the withholding tax ids by type, the journal restrictions and the
+        counterpart tax ids. The result is immutable and cached per registry
+        @return: WithholdingSnapshot
+        """
+        position_model = self.env['account.fiscal.position']
+        company = self.sudo().browse(company_id)
+        position_id = company.partner_id.with_context(force_company=company_id).property_account_position_id.id
+        return WithholdingSnapshot(
+            company_id=company_id,
+            position_id=position_id,
+            config=position_model._get_wh_tax_config(position_id),
+            tax_ids=position_model._get_wh_tax_ids(position_id),
+            sale_tax_ids=position_model._get_wh_tax_ids(position_id, type_tax_use='sale'),
+            purchase_tax_ids=position_model._get_wh_tax_ids(position_id, type_tax_use='purchase'),
+            counterpart_tax_ids=position_model._get_counterpart_tax_ids(position_id, 'sale'),
+        )
+
+
+class ResPartner(models.Model):
+    _name = 'res.partner'
+    _inherit = 'res.partner'
+
+    @api.multi
+    def write(self, vals):
+        if 'property_account_position_id' in vals and \
+                self.env['res.company'].sudo().search_count([('partner_id', 'in', self.ids)]):
+            # The fiscal position of the partner of a company is part of its withholding snapshot
+            self.clear_caches()
+        return super(ResPartner, self).write(vals)
+
 
 class AccountJournal(models.Model):
     _name = "account.journal"
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#                                                                             #
+#                                                                             #
+# Part of Odoo. See LICENSE file for full copyright and licensing details.    #
+#                                                                             #
+#                                                                             #
+#                                                                             #
+# Co-Authors    Odoo LoCo                                                     #
+#               Localización funcional de Odoo para Colombia                  #
+#                                                                             #
+#                                                                             #
+# This program is free software: you can redistribute it and/or modify        #
+# it under the terms of the GNU Affero General Public License as published by #
+# the Free Software Foundation, either version 3 of the License, or           #
+# (at your option) any later version.                                         #
+#                                                                             #
+# This program is distributed in the hope that it will be useful,             #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of              #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the               #
+# GNU Affero General Public License for more details.                         #
+#                                                                             #
+# You should have received a copy of the GNU Affero General Public License    #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.       #
+###############################################################################
+
+"""
+Withholding decision logic, independent from the ORM.
+
+The inputs are plain data structures, built by the models from their registry caches or by any
+other source for offline simulations:
+
+* a position config is a tuple of (tax_id, type_tax_use, journal_ids) entries, one per line of
+  the tax_ids_invoice of a fiscal position
+* a threshold index maps a tax id to a (start_dates, thresholds) pair, where thresholds is a
+  tuple of (start_date, end_date, amount, base_tax_id) sorted by start date
+* a tax spec is a (amount_type, amount, price_include) tuple, used to compute the withheld amounts
+  without the ORM, only for 'percent' and 'fixed' taxes not included in the price
+"""
+
+import math
+from bisect import bisect_right
+from collections import namedtuple
+
+REFUND_TYPES = ('in_refund', 'out_refund')
+PURCHASE_TYPES = ('in_invoice', 'in_refund')
+
+# Inputs of one invoice for the batch evaluation, rounding is the precision of the tax amounts in the invoice
+# currency, as used by compute_all
+WithholdingInput = namedtuple('WithholdingInput', ['company_id', 'position_id', 'journal_id', 'type', 'date',
+                                                   'amount_untaxed', 'wh_taxes', 'rounding'])
+
+
+def tax_use_of(invoice_type):
+    return 'purchase' if invoice_type in PURCHASE_TYPES else 'sale'
+
+
+def filter_config(config, type_tax_use=None, journal_id=None):
+    """
+    Returns the tax ids of a position config in line order. When type_tax_use is given only the taxes of that
+    use are returned, when journal_id is given only the taxes without journals or restricted to that journal
+    @return: tuple
+    """
+    return tuple(tax_id for tax_id, tax_use, journal_ids in config
+                 if (type_tax_use is None or tax_use == type_tax_use) and
+                 (journal_id is None or not journal_ids or journal_id in journal_ids))
+
+
+def build_threshold_index(rows):
+    """
+    Builds a threshold index from (tax_id, start_date, end_date, amount, base_tax_id) rows ordered by tax,
+    start date and id
+    @return: dict
+    """
+    thresholds = {}
+    for tax_id, start_date, end_date, amount, base_id in rows:
+        thresholds.setdefault(tax_id, []).append((start_date, end_date, float(amount), base_id))
+    return {tax_id: (tuple(row[0] for row in items), tuple(items)) for tax_id, items in thresholds.items()}
+
+
+def applicable_tax_ids(index, tax_ids, date, amount=None):
+    """
+    Returns the ids of the taxes that have a threshold active at date and, when amount is given, not greater
+    than amount. A tax is returned once per matching threshold, in threshold order
+    @return: list
+    """
+    if not date:
+        return []
+    matches = []
+    for tax_id in set(tax_ids):
+        start_dates, thresholds = index.get(tax_id, ((), ()))
+        for start_date, end_date, threshold, base_id in thresholds[:bisect_right(start_dates, date)]:
+            if end_date >= date and (amount is None or threshold <= amount):
+                matches.append((base_id, tax_id))
+    return [tax_id for base_id, tax_id in sorted(matches)]
+
+
+def select_withholding_taxes(company_config, partner_config, index, invoice_type, date, amount_untaxed,
+                             journal_id=None, wh_taxes=0.0, inactive_tax_ids=frozenset()):
+    """
+    Returns the withholding tax ids that apply to an invoice: the taxes of the company position of its use
+    and journal, then the taxes of the partner position (None when the invoice has none) with a threshold
+    reached at the invoice date. The amount threshold is ignored on refunds that already withhold. A tax is
+    repeated once per path it comes from
+    @return: list
+    """
+    type_tax_use = tax_use_of(invoice_type)
+    tax_ids = list(filter_config(company_config, type_tax_use=type_tax_use, journal_id=journal_id))
+    if partner_config is not None:
+        partner_tax_ids = [tax_id for tax_id in filter_config(partner_config, type_tax_use=type_tax_use)
+                           if tax_id not in inactive_tax_ids]
+        amount = None if invoice_type in REFUND_TYPES and wh_taxes else amount_untaxed
+        tax_ids += applicable_tax_ids(index, partner_tax_ids, date, amount=amount)
+    return tax_ids
+
+
+def round_amount(value, rounding):
+    """ Rounds half away from zero to the given precision, like the currencies """
+    if not rounding:
+        return value
+    epsilon = 2 ** -40
+    steps = abs(value) / rounding
+    return math.copysign(math.floor(steps + 0.5 + epsilon * steps) * rounding, value)
+
+
+def compute_tax(spec, base, rounding):
+    """
+    Returns the withheld amount of a tax spec on base rounded to rounding, only for 'percent' and 'fixed' taxes
+    not included in the price
+    @return: float
+    """
+    amount_type, amount, price_include = spec
+    if price_include:
+        raise ValueError('Taxes included in the price are not supported by the withholding engine')
+    if amount_type == 'percent':
+        return round_amount(base * amount / 100.0, rounding)
+    if amount_type == 'fixed':
+        return round_amount(amount, rounding)
+    raise ValueError('Tax computation %r is not supported by the withholding engine' % amount_type)
+
+
+class WithholdingEngine(object):
+    """ Evaluates the withholding taxes of many invoices from a snapshot of the configuration:
+    company_positions maps a company id to its position id, positions maps a position id to its config,
+    taxes maps a tax id to its spec"""
+
+    def __init__(self, company_positions, positions, index, taxes, inactive_tax_ids=frozenset()):
+        self.company_positions = company_positions
+        self.positions = positions
+        self.index = index
+        self.taxes = taxes
+        self.inactive_tax_ids = inactive_tax_ids
+        self._static = {}
+
+    def _get_static_tax_ids(self, row):
+        """ The company taxes and the partner candidate taxes only depend on the company, position, journal
+        and type of the invoice, so they are computed once per distinct combination """
+        key = (row.company_id, row.position_id, row.journal_id, row.type)
+        if key not in self._static:
+            type_tax_use = tax_use_of(row.type)
+            company_config = self.positions.get(self.company_positions.get(row.company_id), ())
+            partner_config = self.positions.get(row.position_id, ()) if row.position_id else ()
+            self._static[key] = (
+                filter_config(company_config, type_tax_use=type_tax_use, journal_id=row.journal_id),
+                [tax_id for tax_id in filter_config(partner_config, type_tax_use=type_tax_use)
+                 if tax_id not in self.inactive_tax_ids],
+            )
+        return self._static[key]
+
+    def select(self, row):
+        """
+        Same as select_withholding_taxes for a WithholdingInput
+        @return: list
+        """
+        company_tax_ids, partner_tax_ids = self._get_static_tax_ids(row)
+        amount = None if row.type in REFUND_TYPES and row.wh_taxes else row.amount_untaxed
+        return list(company_tax_ids) + applicable_tax_ids(self.index, partner_tax_ids, row.date, amount=amount)
+
+    def evaluate(self, row):
+        """
+        Returns the withholding lines of one invoice as a list of (tax_id, base, amount), merged by tax
+        @return: list
+        """
+        lines = {}
+        for tax_id in self.select(row):
+            base, total = lines.get(tax_id, (0.0, 0.0))
+            amount = compute_tax(self.taxes[tax_id], row.amount_untaxed, row.rounding)
+            lines[tax_id] = (base + row.amount_untaxed, total + amount)
+        return [(tax_id, base, total) for tax_id, (base, total) in lines.items()]
+
+    def evaluate_batch(self, rows):
+        """
+        Evaluates a sequence of WithholdingInput, or of tuples in the same order
+        @return: list of lists of (tax_id, base, amount)
+        """
+        return [self.evaluate(WithholdingInput(*row)) for row in rows]
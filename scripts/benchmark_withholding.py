@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#                                                                             #
+#                                                                             #
+# Part of Odoo. See LICENSE file for full copyright and licensing details.    #
+#                                                                             #
+#                                                                             #
+#                                                                             #
+# Co-Authors    Odoo LoCo                                                     #
+#               Localización funcional de Odoo para Colombia                  #
+#                                                                             #
+#                                                                             #
+# This program is free software: you can redistribute it and/or modify        #
+# it under the terms of the GNU Affero General Public License as published by #
+# the Free Software Foundation, either version 3 of the License, or           #
+# (at your option) any later version.                                         #
+#                                                                             #
+# This program is distributed in the hope that it will be useful,             #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of              #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the               #
+# GNU Affero General Public License for more details.                         #
+#                                                                             #
+# You should have received a copy of the GNU Affero General Public License    #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.       #
+###############################################################################
+
+"""
+Benchmark of the Colombian withholding pipeline.
+
+Generates partners, fiscal positions with taxes in invoice, journals linked to those taxes,
+base taxes and invoices inside a transaction that is rolled back at the end, then reports the
+wall time and the SQL query count of the withholding overrides.
+
+Usage (from an environment where odoo is importable, against a local database with this module
+installed):
+
+    python scripts/benchmark_withholding.py -d <database> --addons-path=<paths> \
+        [--partners 50] [--positions 10] [--taxes 8] [--invoices 500] [--lines 5] [--cold] [--json file]
+
+Any option not listed above is given to the odoo configuration parser.
+
+The same measures run as a post_install test on a smaller dataset:
+
+    odoo-bin -d <database> --addons-path=<paths> --test-enable --test-tags benchmark --stop-after-init
+"""
+
+import argparse
+import json
+import random
+import time
+from datetime import date
+
+import odoo
+from odoo import SUPERUSER_ID, api, fields
+
+
+def _account(env, company, internal_type=None, user_type=None):
+    domain = [('company_id', '=', company.id), ('deprecated', '=', False)]
+    if internal_type:
+        domain.append(('internal_type', '=', internal_type))
+    if user_type:
+        domain.append(('user_type_id', '=', env.ref(user_type).id))
+    return env['account.account'].search(domain, limit=1)
+
+
+def generate_dataset(env, partners=50, positions=10, taxes=8, invoices=500, lines=5, seed=42):
+    """
+    Creates the configuration and the draft invoices of the benchmark in the company of the user
+    @return: dict with the created records
+    """
+    rnd = random.Random(seed)
+    company = env.user.company_id
+    year = fields.Date.context_today(env.user).year
+    tax_account = _account(env, company, user_type='account.data_account_type_current_liabilities')
+    income_account = _account(env, company, user_type='account.data_account_type_revenue')
+    expense_account = _account(env, company, user_type='account.data_account_type_expenses')
+
+    journals = env['account.journal'].search([('company_id', '=', company.id), ('type', '=', 'sale')])
+    journals |= env['account.journal'].create([{
+        'name': 'Benchmark sales %s' % i,
+        'code': 'BS%s' % i,
+        'type': 'sale',
+        'company_id': company.id,
+    } for i in range(2)])
+
+    wh_taxes = env['account.tax'].create([{
+        'name': 'Benchmark withholding %s %s' % (type_tax_use, i),
+        'amount_type': 'percent',
+        'amount': -rnd.choice([0.4, 1.0, 2.5, 3.5, 4.0, 11.0]),
+        'type_tax_use': type_tax_use,
+        'tax_in_invoice': True,
+        'uvt_base': rnd.choice([4, 27, 92]),
+        'account_id': tax_account.id,
+        'refund_account_id': tax_account.id,
+        'company_id': company.id,
+    } for i in range(taxes) for type_tax_use in ('sale', 'purchase')])
+    counterpart_tax = env['account.tax'].create({
+        'name': 'Benchmark self withholding',
+        'amount_type': 'percent',
+        'amount': 0.8,
+        'type_tax_use': 'sale',
+        'tax_in_invoice': True,
+        'dont_impact_balance': True,
+        'account_id': tax_account.id,
+        'refund_account_id': tax_account.id,
+        'account_id_counterpart': tax_account.id,
+        'refund_account_id_counterpart': tax_account.id,
+        'company_id': company.id,
+    })
+
+    env['account.base.tax'].create_uvt_thresholds(
+        35607.0, {tax.id: tax.uvt_base for tax in wh_taxes}, date(year, 1, 1), date(year, 12, 31))
+
+    company_position = env['account.fiscal.position'].create({
+        'name': 'Benchmark company position',
+        'company_id': company.id,
+        'tax_ids_invoice': [(0, 0, {'tax_id': counterpart_tax.id}),
+                            (0, 0, {'tax_id': wh_taxes[0].id, 'account_journal_ids': [(6, 0, journals[-1:].ids)]})],
+    })
+    company.partner_id.property_account_position_id = company_position
+
+    fiscal_positions = env['account.fiscal.position'].create([{
+        'name': 'Benchmark position %s' % i,
+        'company_id': company.id,
+        'tax_ids_invoice': [(0, 0, {
+            'tax_id': tax.id,
+            'account_journal_ids': [(6, 0, rnd.sample(journals.ids, 1))] if rnd.random() < 0.3 else [],
+        }) for tax in wh_taxes if rnd.random() < 0.5],
+    } for i in range(positions)])
+
+    partner_records = env['res.partner'].create([{
+        'name': 'Benchmark partner %s' % i,
+        'property_account_position_id': rnd.choice(fiscal_positions).id,
+    } for i in range(partners)])
+
+    product = env['product.product'].create({
+        'name': 'Benchmark product',
+        'property_account_income_id': income_account.id,
+        'property_account_expense_id': expense_account.id,
+    })
+
+    invoice_records = env['account.invoice']
+    for i in range(invoices):
+        partner = rnd.choice(partner_records)
+        invoice_records |= env['account.invoice'].create({
+            'partner_id': partner.id,
+            'fiscal_position_id': partner.property_account_position_id.id,
+            'journal_id': rnd.choice(journals).id,
+            'type': 'out_invoice',
+            'date_invoice': date(year, rnd.randint(1, 12), rnd.randint(1, 28)),
+            'invoice_line_ids': [(0, 0, {
+                'product_id': product.id,
+                'name': product.name,
+                'account_id': income_account.id,
+                'quantity': rnd.randint(1, 10),
+                'price_unit': rnd.choice([50000.0, 150000.0, 900000.0, 4500000.0]),
+            }) for j in range(lines)],
+        })
+    invoice_records.compute_taxes()
+
+    return {
+        'company': company,
+        'journals': journals,
+        'taxes': wh_taxes | counterpart_tax,
+        'positions': fiscal_positions | company_position,
+        'partners': partner_records,
+        'invoices': invoice_records,
+    }
+
+
+def measure(env, name, size, function, cold=False):
+    """
+    Runs function and returns its wall time and SQL query count. With cold, the registry caches and
+    the record cache are cleared first
+    @return: dict
+    """
+    if cold:
+        env.registry.clear_caches()
+    env.invalidate_all()
+    queries = env.cr.sql_log_count
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    return {
+        'name': name,
+        'records': size,
+        'seconds': elapsed,
+        'queries': env.cr.sql_log_count - queries,
+        'ms_per_record': elapsed * 1000.0 / (size or 1),
+    }
+
+
+def run_benchmark(env, invoices, cold=False):
+    """
+    Measures the withholding overrides on the given draft invoices, validating them at the end
+    @return: list of measures
+    """
+    measures = [
+        measure(env, 'get_taxes_values', len(invoices),
+                lambda: [invoice.get_taxes_values() for invoice in invoices], cold),
+        measure(env, '_compute_amount', len(invoices), invoices._compute_amount, cold),
+        measure(env, 'tax_line_move_line_get', len(invoices),
+                lambda: [invoice.tax_line_move_line_get() for invoice in invoices], cold),
+        measure(env, 'action_invoice_open', len(invoices), invoices.action_invoice_open, cold),
+        measure(env, '_compute_residual', len(invoices), invoices._compute_residual, cold),
+    ]
+    return measures
+
+
+def print_measures(measures):
+    print('%-24s %8s %10s %10s %12s' % ('operation', 'records', 'seconds', 'queries', 'ms/record'))
+    for row in measures:
+        print('%-24s %8d %10.3f %10d %12.3f' % (
+            row['name'], row['records'], row['seconds'], row['queries'], row['ms_per_record']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--partners', type=int, default=50)
+    parser.add_argument('--positions', type=int, default=10)
+    parser.add_argument('--taxes', type=int, default=8)
+    parser.add_argument('--invoices', type=int, default=500)
+    parser.add_argument('--lines', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--cold', action='store_true', help='clear the caches before each measure')
+    parser.add_argument('--json', help='also write the measures to this file')
+    args, odoo_args = parser.parse_known_args()
+
+    odoo.tools.config.parse_config(odoo_args)
+    registry = odoo.registry(odoo.tools.config['db_name'])
+    with api.Environment.manage(), registry.cursor() as cr:
+        env = api.Environment(cr, SUPERUSER_ID, {})
+        try:
+            start = time.perf_counter()
+            dataset = generate_dataset(env, partners=args.partners, positions=args.positions, taxes=args.taxes,
+                                       invoices=args.invoices, lines=args.lines, seed=args.seed)
+            print('Dataset generated in %.3f s' % (time.perf_counter() - start))
+            measures = run_benchmark(env, dataset['invoices'], cold=args.cold)
+        finally:
+            cr.rollback()
+
+    print_measures(measures)
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(measures, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
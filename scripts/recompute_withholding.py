@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#                                                                             #
+#                                                                             #
+# Part of Odoo. See LICENSE file for full copyright and licensing details.    #
+#                                                                             #
+#                                                                             #
+#                                                                             #
+# Co-Authors    Odoo LoCo                                                     #
+#               Localización funcional de Odoo para Colombia                  #
+#                                                                             #
+#                                                                             #
+# This program is free software: you can redistribute it and/or modify        #
+# it under the terms of the GNU Affero General Public License as published by #
+# the Free Software Foundation, either version 3 of the License, or           #
+# (at your option) any later version.                                         #
+#                                                                             #
+# This program is distributed in the hope that it will be useful,             #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of              #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the               #
+# GNU Affero General Public License for more details.                         #
+#                                                                             #
+# You should have received a copy of the GNU Affero General Public License    #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.       #
+###############################################################################
+
+"""
+Parallel recompute of the withholding taxes of historical invoices.
+
+Splits the ids of the selected invoices into disjoint ranges processed by several processes, each one
+with its own registry and cursors. Every chunk is committed on its own and retried when PostgreSQL
+aborts it on a serialization failure or a deadlock. Draft invoices get their tax lines regenerated,
+all invoices get wh_taxes, amount_without_wh_tax, the totals and the residual recomputed. A report
+compares the totals per company before and after.
+
+Usage (from an environment where odoo is importable):
+
+    python scripts/recompute_withholding.py -d <database> --addons-path=<paths> \
+        [--workers 4] [--chunk 500] [--date-from 2020-01-01] [--date-to 2020-12-31] [--company 1] [--state draft]
+
+Any option not listed above is given to the odoo configuration parser.
+"""
+
+import argparse
+import logging
+import multiprocessing
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+import odoo
+from odoo import SUPERUSER_ID, api
+
+_logger = logging.getLogger('recompute_withholding')
+
+TOTALS_QUERY = """
+    SELECT company_id, COUNT(*), COALESCE(SUM(wh_taxes), 0), COALESCE(SUM(amount_without_wh_tax), 0),
+           COALESCE(SUM(amount_total), 0), COALESCE(SUM(residual), 0)
+      FROM account_invoice
+     WHERE id IN %s
+  GROUP BY company_id
+  ORDER BY company_id
+"""
+TOTAL_COLUMNS = ('invoices', 'wh_taxes', 'amount_without_wh_tax', 'amount_total', 'residual')
+INVOICE_FIELDS = ('wh_taxes', 'amount_without_wh_tax', 'amount_total', 'residual')
+
+
+def select_invoice_ids(cr, args):
+    query = 'SELECT id FROM account_invoice WHERE TRUE'
+    params = []
+    if args.date_from:
+        query += ' AND date_invoice >= %s'
+        params.append(args.date_from)
+    if args.date_to:
+        query += ' AND date_invoice <= %s'
+        params.append(args.date_to)
+    if args.company:
+        query += ' AND company_id IN %s'
+        params.append(tuple(args.company))
+    if args.state:
+        query += ' AND state IN %s'
+        params.append(tuple(args.state))
+    cr.execute(query + ' ORDER BY id', params)
+    return [row[0] for row in cr.fetchall()]
+
+
+def read_totals(cr, ids):
+    totals = {}
+    for start in range(0, len(ids), 100000):
+        cr.execute(TOTALS_QUERY, (tuple(ids[start:start + 100000]),))
+        for row in cr.fetchall():
+            company_totals = totals.setdefault(row[0], [0] * len(TOTAL_COLUMNS))
+            for i, value in enumerate(row[1:]):
+                company_totals[i] += value
+    return totals
+
+
+def partition(ids, parts):
+    """ Splits the sorted ids into at most parts disjoint ranges of consecutive ids """
+    size = max(1, -(-len(ids) // parts))
+    return [ids[start:start + size] for start in range(0, len(ids), size)]
+
+
+def process_range(task):
+    """
+    Recomputes a range of invoices chunk by chunk in the current process, with a cursor and a commit per
+    chunk and a retry with backoff on serialization failures
+    @return: (processed, changed, failed ids)
+    """
+    db_name, ids, chunk_size, retries = task
+    processed = changed = 0
+    failed = []
+    # Environments need the thread-local storage set up by manage(), like odoo shell
+    with api.Environment.manage():
+        registry = odoo.registry(db_name)
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            for attempt in range(retries + 1):
+                try:
+                    with registry.cursor() as cr:
+                        env = api.Environment(cr, SUPERUSER_ID, {})
+                        invoices = env['account.invoice'].browse(chunk).exists()
+                        before = {values['id']: values for values in invoices.read(INVOICE_FIELDS)}
+                        invoices._recompute_withholding()
+                        invoices.invalidate_cache()
+                        after = invoices.read(INVOICE_FIELDS)
+                        chunk_changed = sum(1 for values in after if any(
+                            abs(values[name] - before[values['id']][name]) > 1e-6 for name in INVOICE_FIELDS))
+                        chunk_processed = len(invoices)
+                    # Only counted once the cursor committed, a failure at commit time retries the chunk
+                    processed += chunk_processed
+                    changed += chunk_changed
+                    break
+                except psycopg2.extensions.TransactionRollbackError:
+                    if attempt == retries:
+                        _logger.error('Chunk %s-%s failed after %d retries', chunk[0], chunk[-1], retries)
+                        failed += chunk
+                    else:
+                        time.sleep(0.5 * 2 ** attempt)
+                except Exception:
+                    _logger.exception('Chunk %s-%s failed', chunk[0], chunk[-1])
+                    failed += chunk
+                    break
+    return processed, changed, failed
+
+
+def print_report(before, after, processed, changed, failed, elapsed):
+    print('Processed %d invoices in %.1f s, %d changed, %d failed' % (processed, elapsed, changed, len(failed)))
+    print('%-8s %-22s %18s %18s %18s' % ('company', 'total', 'before', 'after', 'difference'))
+    for company_id in sorted(set(before) | set(after)):
+        old = before.get(company_id, [0] * len(TOTAL_COLUMNS))
+        new = after.get(company_id, [0] * len(TOTAL_COLUMNS))
+        for name, old_value, new_value in zip(TOTAL_COLUMNS, old, new):
+            print('%-8s %-22s %18.2f %18.2f %18.2f' % (company_id, name, old_value, new_value, new_value - old_value))
+    if failed:
+        print('Failed invoice ids: %s' % ', '.join(str(invoice_id) for invoice_id in failed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--chunk', type=int, default=500, help='invoices per transaction')
+    parser.add_argument('--retries', type=int, default=5, help='retries of a chunk on serialization failures')
+    parser.add_argument('--date-from')
+    parser.add_argument('--date-to')
+    parser.add_argument('--company', type=int, action='append')
+    parser.add_argument('--state', action='append', help='invoice states to process, all by default')
+    args, odoo_args = parser.parse_known_args()
+
+    odoo.tools.config.parse_config(odoo_args)
+    db_name = odoo.tools.config['db_name']
+
+    with odoo.sql_db.db_connect(db_name).cursor() as cr:
+        ids = select_invoice_ids(cr, args)
+        before = read_totals(cr, ids) if ids else {}
+    # The processes must not share the connections of the parent
+    odoo.sql_db.close_all()
+
+    start = time.time()
+    tasks = [(db_name, ids_range, args.chunk, args.retries) for ids_range in partition(ids, args.workers * 4)]
+    processed = changed = 0
+    failed = []
+    with multiprocessing.get_context('fork').Pool(args.workers) as pool:
+        for range_processed, range_changed, range_failed in pool.imap_unordered(process_range, tasks):
+            processed += range_processed
+            changed += range_changed
+            failed += range_failed
+            _logger.info('%d/%d invoices processed', processed, len(ids))
+    elapsed = time.time() - start
+
+    with odoo.sql_db.db_connect(db_name).cursor() as cr:
+        after = read_totals(cr, ids) if ids else {}
+    print_report(before, after, processed, changed, sorted(failed), elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#                                                                             #
+#                                                                             #
+# Part of Odoo. See LICENSE file for full copyright and licensing details.    #
+#                                                                             #
+#                                                                             #
+#                                                                             #
+# Co-Authors    Odoo LoCo                                                     #
+#               Localización funcional de Odoo para Colombia                  #
+#                                                                             #
+#                                                                             #
+# This program is free software: you can redistribute it and/or modify        #
+# it under the terms of the GNU Affero General Public License as published by #
+# the Free Software Foundation, either version 3 of the License, or           #
+# (at your option) any later version.                                         #
+#                                                                             #
+# This program is distributed in the hope that it will be useful,             #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of              #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the               #
+# GNU Affero General Public License for more details.                         #
+#                                                                             #
+# You should have received a copy of the GNU Affero General Public License    #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.       #
+###############################################################################
+
+"""
+Golden-data regression harness of the Colombian withholding pipeline.
+
+export: writes the withholding configuration of a company and a set of its invoices to a gzipped JSON
+fixture. Names, partners, products and accounts are left out and every id is replaced by a key local to
+the fixture; amounts and dates are kept since the thresholds depend on them. Each invoice records its
+stored tax lines grouped by tax, wh_taxes, amount_total and, when it has no payments, its residual.
+
+replay: recreates the configuration and the invoices of a fixture inside a transaction that is rolled
+back at the end, computes their taxes, validates the ones recorded as validated, and diffs the results
+against the recorded values. The throughput of each step is reported with the correctness.
+
+Only invoices in the currency of the company are exported. Refunds are left out by default since their
+withholding depends on the refunded invoice. The recorded values are the stored ones: run
+recompute_withholding.py first when the configuration changed since the invoices were computed.
+
+Usage (from an environment where odoo is importable, against a local test database with this module
+installed):
+
+    python scripts/withholding_regression.py export fixture.json.gz -d <database> --addons-path=<paths> \
+        [--company 1] [--date-from 2020-01-01] [--date-to 2020-12-31] [--limit 10000]
+    python scripts/withholding_regression.py replay fixture.json.gz -d <database> --addons-path=<paths> \
+        [--tolerance 0.01] [--show 20]
+
+Any option not listed above is given to the odoo configuration parser. replay exits with status 1 when
+an invoice differs from its recorded values. The script imports the helpers of benchmark_withholding.py
+from its own directory, so it is started by its path as above, or imported from the scripts package of the
+module as the tests do.
+"""
+
+import argparse
+import gzip
+import json
+import sys
+import time
+
+import odoo
+from odoo import SUPERUSER_ID, api, fields
+
+try:
+    from .benchmark_withholding import _account, measure, print_measures
+except ImportError:
+    # Started as a script, its directory is then the first entry of sys.path
+    from benchmark_withholding import _account, measure, print_measures
+
+FIXTURE_VERSION = 1
+VALIDATED_STATES = ('open', 'in_payment', 'paid')
+TAX_FIELDS = ('amount_type', 'amount', 'type_tax_use', 'price_include', 'include_base_amount', 'sequence',
+              'tax_in_invoice', 'dont_impact_balance', 'uvt_base')
+
+
+class KeyMap(dict):
+    """ Maps the ids of a model to keys local to the fixture, in order of appearance """
+
+    def key(self, record_id):
+        if not record_id:
+            return None
+        return self.setdefault(record_id, len(self) + 1)
+
+
+def _group_taxes(tax_lines, tax_key):
+    grouped = {}
+    for line in tax_lines:
+        values = grouped.setdefault(str(tax_key(line)), [0.0, 0.0])
+        values[0] += line['base']
+        values[1] += line['amount']
+    return grouped
+
+
+def export_fixture(env, company, invoices):
+    """
+    Returns the anonymized fixture of the invoices and of the configuration they depend on
+    @return: dict
+    """
+    tax_keys, position_keys, journal_keys = KeyMap(), KeyMap(), KeyMap()
+    company_position_id = env['res.company']._get_wh_snapshot(company.id).position_id
+
+    exported_invoices = []
+    for invoice in invoices:
+        recorded = {
+            'taxes': _group_taxes(invoice.tax_line_ids, lambda line: tax_keys.key(line.tax_id.id)),
+            'wh_taxes': invoice.wh_taxes,
+            'amount_total': invoice.amount_total,
+            'residual': None if invoice.payment_move_line_ids else invoice.residual,
+        }
+        exported_invoices.append({
+            'type': invoice.type,
+            'date': fields.Date.to_string(invoice.date_invoice),
+            'journal': journal_keys.key(invoice.journal_id.id),
+            'position': position_keys.key(invoice.fiscal_position_id.id),
+            'validated': invoice.state in VALIDATED_STATES,
+            'lines': [[line.quantity, line.price_unit, line.discount,
+                       [tax_keys.key(tax.id) for tax in line.invoice_line_tax_ids]]
+                      for line in invoice.invoice_line_ids],
+            'recorded': recorded,
+        })
+
+    position_keys.key(company_position_id)
+    positions = {}
+    for position_id, key in list(position_keys.items()):
+        positions[str(key)] = [[tax_keys.key(tax_id), sorted(journal_keys.key(journal_id) for journal_id in journals)]
+                               for tax_id, tax_use, journals in
+                               env['account.fiscal.position']._get_wh_tax_config(position_id) if tax_id]
+
+    taxes = {}
+    pending = list(tax_keys)
+    while pending:
+        tax = env['account.tax'].with_context(active_test=False).browse(pending.pop())
+        if str(tax_keys[tax.id]) in taxes:
+            continue
+        values = {name: tax[name] for name in TAX_FIELDS}
+        values['active'] = tax.active
+        values['children'] = [tax_keys.key(child.id) for child in tax.children_tax_ids]
+        pending += tax.children_tax_ids.ids
+        values['thresholds'] = [[fields.Date.to_string(base.start_date), fields.Date.to_string(base.end_date),
+                                 base.amount] for base in tax.base_taxes.sorted('start_date')]
+        taxes[str(tax_keys[tax.id])] = values
+
+    journals = {str(key): env['account.journal'].browse(journal_id).type for journal_id, key in journal_keys.items()}
+
+    return {
+        'version': FIXTURE_VERSION,
+        'company_position': position_keys.get(company_position_id),
+        'taxes': taxes,
+        'journals': journals,
+        'positions': positions,
+        'invoices': exported_invoices,
+    }
+
+
+def load_fixture(env, fixture):
+    """
+    Creates the configuration and the draft invoices of a fixture in the company of the user
+    @return: (list of (invoice, fixture invoice) pairs, dict mapping the created tax ids to their fixture keys)
+    """
+    company = env.user.company_id
+    tax_account = _account(env, company, user_type='account.data_account_type_current_liabilities')
+    line_accounts = {
+        'sale': _account(env, company, user_type='account.data_account_type_revenue'),
+        'purchase': _account(env, company, user_type='account.data_account_type_expenses'),
+    }
+
+    journals = {key: env['account.journal'].create({
+        'name': 'Regression %s %s' % (journal_type, key),
+        'code': 'R%s' % key,
+        'type': journal_type,
+        'company_id': company.id,
+    }) for key, journal_type in fixture['journals'].items()}
+
+    taxes = {}
+
+    def create_tax(key):
+        # Children taxes are created before the group taxes that use them
+        if key in taxes:
+            return taxes[key]
+        values = fixture['taxes'][key]
+        children = [create_tax(str(child)).id for child in values['children']]
+        vals = {name: values[name] for name in TAX_FIELDS}
+        vals.update({
+            'name': 'Regression tax %s' % key,
+            'active': values['active'],
+            'account_id': tax_account.id,
+            'refund_account_id': tax_account.id,
+            'account_id_counterpart': values['dont_impact_balance'] and tax_account.id,
+            'refund_account_id_counterpart': values['dont_impact_balance'] and tax_account.id,
+            'company_id': company.id,
+            'children_tax_ids': [(6, 0, children)],
+        })
+        taxes[key] = env['account.tax'].create(vals)
+        return taxes[key]
+
+    for key in fixture['taxes']:
+        create_tax(key)
+    env['account.base.tax'].create([{
+        'tax_id': taxes[key].id,
+        'start_date': start_date,
+        'end_date': end_date,
+        'amount': amount,
+    } for key, values in fixture['taxes'].items() for start_date, end_date, amount in values['thresholds']])
+
+    positions = {key: env['account.fiscal.position'].create({
+        'name': 'Regression position %s' % key,
+        'company_id': company.id,
+        'tax_ids_invoice': [(0, 0, {
+            'tax_id': taxes[str(tax_key)].id,
+            'account_journal_ids': [(6, 0, [journals[str(journal_key)].id for journal_key in journal_keys])],
+        }) for tax_key, journal_keys in lines],
+    }) for key, lines in fixture['positions'].items()}
+    company_position = positions.get(str(fixture['company_position']))
+    company.partner_id.property_account_position_id = company_position or False
+
+    partners = {key: env['res.partner'].create({
+        'name': 'Regression partner %s' % key,
+        'property_account_position_id': position.id,
+    }) for key, position in positions.items()}
+    partners[None] = env['res.partner'].create({'name': 'Regression partner'})
+
+    pairs = []
+    for values in fixture['invoices']:
+        position_key = values['position'] and str(values['position'])
+        use = 'sale' if values['type'] in ('out_invoice', 'out_refund') else 'purchase'
+        invoice = env['account.invoice'].create({
+            'partner_id': partners[position_key].id,
+            'fiscal_position_id': position_key and positions[position_key].id or False,
+            'journal_id': journals[str(values['journal'])].id,
+            'type': values['type'],
+            'date_invoice': values['date'],
+            'invoice_line_ids': [(0, 0, {
+                'name': 'Regression line',
+                'account_id': line_accounts[use].id,
+                'quantity': quantity,
+                'price_unit': price_unit,
+                'discount': discount,
+                'invoice_line_tax_ids': [(6, 0, [taxes[str(tax_key)].id for tax_key in tax_keys])],
+            }) for quantity, price_unit, discount, tax_keys in values['lines']],
+        })
+        pairs.append((invoice, values))
+    return pairs, {tax.id: key for key, tax in taxes.items()}
+
+
+def diff_invoice(invoice, recorded, tax_keys, tolerance):
+    """
+    Returns the differences between the replayed invoice and its recorded values
+    @return: list of (name, recorded, replayed)
+    """
+    differences = []
+    taxes = _group_taxes(invoice.tax_line_ids, lambda line: tax_keys.get(line.tax_id.id))
+    for key in sorted(set(taxes) | set(recorded['taxes'])):
+        expected = recorded['taxes'].get(key, [0.0, 0.0])
+        actual = taxes.get(key, [0.0, 0.0])
+        for name, expected_value, actual_value in zip(('base', 'amount'), expected, actual):
+            if abs(expected_value - actual_value) > tolerance:
+                differences.append(('tax %s %s' % (key, name), expected_value, actual_value))
+    for name in ('wh_taxes', 'amount_total', 'residual'):
+        if recorded[name] is not None and abs(recorded[name] - invoice[name]) > tolerance:
+            differences.append((name, recorded[name], invoice[name]))
+    return differences
+
+
+def replay_fixture(env, fixture, tolerance=0.01):
+    """
+    Replays a fixture and returns the measures of each step and the differences of every invoice
+    @return: (measures, {fixture invoice index: differences})
+    """
+    start = time.perf_counter()
+    pairs, tax_keys = load_fixture(env, fixture)
+    print('Fixture loaded in %.3f s' % (time.perf_counter() - start))
+    invoices = env['account.invoice'].concat(*[invoice for invoice, values in pairs])
+    validated = env['account.invoice'].concat(*[invoice for invoice, values in pairs if values['validated']])
+
+    measures = [
+        measure(env, 'compute_taxes', len(invoices), invoices.compute_taxes),
+        measure(env, '_compute_amount', len(invoices), invoices._compute_amount),
+        measure(env, 'action_invoice_open', len(validated), validated.action_invoice_open),
+        measure(env, '_compute_residual', len(validated), validated._compute_residual),
+    ]
+
+    differences = {}
+    for index, (invoice, values) in enumerate(pairs):
+        invoice_differences = diff_invoice(invoice, values['recorded'], tax_keys, tolerance)
+        if invoice_differences:
+            differences[index] = invoice_differences
+    return measures, differences
+
+
+def print_differences(differences, total, show):
+    print('%d/%d invoices match their recorded values' % (total - len(differences), total))
+    for index in sorted(differences)[:show]:
+        for name, expected, actual in differences[index]:
+            print('  invoice %-8d %-24s recorded %16.2f replayed %16.2f' % (index, name, expected, actual))
+    if len(differences) > show:
+        print('  ... %d more invoices differ' % (len(differences) - show))
+
+
+def print_throughput(measures):
+    for row in measures:
+        if row['seconds']:
+            print('%-24s %12.1f invoices/sec' % (row['name'], row['records'] / row['seconds']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('command', choices=('export', 'replay'))
+    parser.add_argument('fixture', help='gzipped JSON fixture to write or to replay')
+    parser.add_argument('--company', type=int, help='company to export, the company of the admin by default')
+    parser.add_argument('--date-from')
+    parser.add_argument('--date-to')
+    parser.add_argument('--types', default='out_invoice,in_invoice', help='comma separated invoice types to export')
+    parser.add_argument('--limit', type=int)
+    parser.add_argument('--tolerance', type=float, default=0.01)
+    parser.add_argument('--show', type=int, default=20, help='differing invoices to print')
+    args, odoo_args = parser.parse_known_args()
+
+    odoo.tools.config.parse_config(odoo_args)
+    registry = odoo.registry(odoo.tools.config['db_name'])
+    with api.Environment.manage(), registry.cursor() as cr:
+        env = api.Environment(cr, SUPERUSER_ID, {})
+        try:
+            if args.command == 'export':
+                company = env['res.company'].browse(args.company) if args.company else env.user.company_id
+                domain = [('company_id', '=', company.id), ('currency_id', '=', company.currency_id.id),
+                          ('type', 'in', args.types.split(',')), ('state', '!=', 'cancel')]
+                if args.date_from:
+                    domain.append(('date_invoice', '>=', args.date_from))
+                if args.date_to:
+                    domain.append(('date_invoice', '<=', args.date_to))
+                invoices = env['account.invoice'].search(domain, order='id', limit=args.limit)
+                fixture = export_fixture(env, company, invoices)
+                with gzip.open(args.fixture, 'wt') as output:
+                    json.dump(fixture, output, separators=(',', ':'))
+                print('Exported %d invoices and %d taxes' % (len(fixture['invoices']), len(fixture['taxes'])))
+                return
+            with gzip.open(args.fixture, 'rt') as source:
+                fixture = json.load(source)
+            if fixture.get('version') != FIXTURE_VERSION:
+                sys.exit('Unsupported fixture version %s' % fixture.get('version'))
+            measures, differences = replay_fixture(env, fixture, tolerance=args.tolerance)
+        finally:
+            cr.rollback()
+
+    print_measures(measures)
+    print_throughput(measures)
+    print_differences(differences, len(fixture['invoices']), args.show)
+    if differences:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#                                                                             #
+#                                                                             #
+# Part of Odoo. See LICENSE file for full copyright and licensing details.    #
+#                                                                             #
+#                                                                             #
+#                                                                             #
+# Co-Authors    Odoo LoCo                                                     #
+#               Localización funcional de Odoo para Colombia                  #
+#                                                                             #
+#                                                                             #
+# This program is free software: you can redistribute it and/or modify        #
+# it under the terms of the GNU Affero General Public License as published by #
+# the Free Software Foundation, either version 3 of the License, or           #
+# (at your option) any later version.                                         #
+#                                                                             #
+# This program is distributed in the hope that it will be useful,             #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of              #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the               #
+# GNU Affero General Public License for more details.                         #
+#                                                                             #
+# You should have received a copy of the GNU Affero General Public License    #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.       #
+###############################################################################
+
+from unittest.mock import patch
+
+from odoo.tests import tagged
+from odoo.tests.common import TransactionCase
+
+from ..scripts.benchmark_withholding import generate_dataset
+
+
+@tagged('-at_install', 'post_install')
+class TestActionInvoiceOpenBatch(TransactionCase):
+    """ Grouped validation of draft invoices """
+
+    def setUp(self):
+        super(TestActionInvoiceOpenBatch, self).setUp()
+        self.invoices = generate_dataset(self.env, partners=6, positions=2, taxes=3, invoices=30, lines=2)['invoices']
+
+    def _get_tax_lines(self, invoices):
+        return {invoice.id: sorted((line.tax_id.id, round(line.base, 2), round(line.amount, 2))
+                                   for line in invoice.tax_line_ids) for invoice in invoices}
+
+    def test_one_lookup_per_group(self):
+        expected_lines = self._get_tax_lines(self.invoices)
+        groups = {(invoice.company_id.id, invoice.fiscal_position_id.id, invoice.journal_id.id, invoice.type,
+                   invoice.date_invoice) for invoice in self.invoices}
+
+        invoice_class = type(self.env['account.invoice'])
+        base_tax_class = type(self.env['account.base.tax'])
+        get_group_inputs = invoice_class._get_wh_group_inputs
+        get_threshold_index = base_tax_class._get_threshold_index
+        group_calls = []
+        index_calls = []
+
+        def counted_group_inputs(invoice):
+            group_calls.append(invoice.id)
+            return get_group_inputs(invoice)
+
+        def counted_threshold_index(model):
+            index_calls.append(model._name)
+            return get_threshold_index(model)
+
+        with patch.object(invoice_class, '_get_wh_group_inputs', counted_group_inputs), \
+                patch.object(base_tax_class, '_get_threshold_index', counted_threshold_index):
+            self.invoices.action_invoice_open_batch()
+
+        self.assertEqual(len(group_calls), len(groups))
+        self.assertEqual(len(index_calls), len(groups))
+        self.assertEqual(set(self.invoices.mapped('state')), {'open'})
+        self.invoices.invalidate_cache()
+        self.assertEqual(self._get_tax_lines(self.invoices), expected_lines)
+
+    def test_skip_validated_invoices(self):
+        posted = self.invoices[:1]
+        posted.action_invoice_open()
+        move = posted.move_id
+        self.invoices.action_invoice_open_batch()
+        self.assertEqual(set(self.invoices.mapped('state')), {'open'})
+        self.assertEqual(posted.move_id, move)
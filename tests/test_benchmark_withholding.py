@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#                                                                             #
+#                                                                             #
+# Part of Odoo. See LICENSE file for full copyright and licensing details.    #
+#                                                                             #
+#                                                                             #
+#                                                                             #
+# Co-Authors    Odoo LoCo                                                     #
+#               Localización funcional de Odoo para Colombia                  #
+#                                                                             #
+#                                                                             #
+# This program is free software: you can redistribute it and/or modify        #
+# it under the terms of the GNU Affero General Public License as published by #
+# the Free Software Foundation, either version 3 of the License, or           #
+# (at your option) any later version.                                         #
+#                                                                             #
+# This program is distributed in the hope that it will be useful,             #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of              #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the               #
+# GNU Affero General Public License for more details.                         #
+#                                                                             #
+# You should have received a copy of the GNU Affero General Public License    #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.       #
+###############################################################################
+
+import logging
+
+from odoo.tests import tagged
+from odoo.tests.common import TransactionCase
+
+from ..scripts.benchmark_withholding import generate_dataset, measure
+
+_logger = logging.getLogger(__name__)
+
+
+@tagged('-at_install', 'post_install', 'benchmark')
+class TestBenchmarkWithholding(TransactionCase):
+    """ Benchmark of the withholding overrides on a generated dataset, run with --test-tags benchmark """
+
+    def setUp(self):
+        super(TestBenchmarkWithholding, self).setUp()
+        self.dataset = generate_dataset(self.env, partners=20, positions=5, taxes=4, invoices=100, lines=3)
+        self.invoices = self.dataset['invoices']
+
+    def _log_measures(self, measures):
+        for row in measures:
+            _logger.info('%s: %d records in %.3f s, %d queries, %.3f ms/record', row['name'], row['records'],
+                         row['seconds'], row['queries'], row['ms_per_record'])
+
+    def test_benchmark_draft_invoices(self):
+        measures = [
+            measure(self.env, 'get_taxes_values', len(self.invoices),
+                    lambda: [invoice.get_taxes_values() for invoice in self.invoices]),
+            measure(self.env, '_compute_amount', len(self.invoices), self.invoices._compute_amount),
+            measure(self.env, 'tax_line_move_line_get', len(self.invoices),
+                    lambda: [invoice.tax_line_move_line_get() for invoice in self.invoices]),
+        ]
+        self._log_measures(measures)
+        self.assertTrue(any(self.invoices.mapped('wh_taxes')), 'The dataset should have withholding taxes')
+        for invoice in self.invoices:
+            self.assertAlmostEqual(invoice.amount_total, invoice.amount_without_wh_tax - invoice.wh_taxes)
+
+    def test_benchmark_validation(self):
+        measures = [
+            measure(self.env, 'action_invoice_open', len(self.invoices), self.invoices.action_invoice_open),
+            measure(self.env, '_compute_residual', len(self.invoices), self.invoices._compute_residual),
+        ]
+        self._log_measures(measures)
+        self.assertEqual(set(self.invoices.mapped('state')), {'open'})
+        self.assertTrue(all(self.invoices.mapped('residual')), 'Validated invoices should have a residual')
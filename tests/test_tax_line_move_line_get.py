@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#                                                                             #
+#                                                                             #
+# Part of Odoo. See LICENSE file for full copyright and licensing details.    #
+#                                                                             #
+#                                                                             #
+#                                                                             #
+# Co-Authors    Odoo LoCo                                                     #
+#               Localización funcional de Odoo para Colombia                  #
+#                                                                             #
+#                                                                             #
+# This program is free software: you can redistribute it and/or modify        #
+# it under the terms of the GNU Affero General Public License as published by #
+# the Free Software Foundation, either version 3 of the License, or           #
+# (at your option) any later version.                                         #
+#                                                                             #
+# This program is distributed in the hope that it will be useful,             #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of              #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the               #
+# GNU Affero General Public License for more details.                         #
+#                                                                             #
+# You should have received a copy of the GNU Affero General Public License    #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.       #
+###############################################################################
+
+from odoo import fields
+from odoo.exceptions import UserError
+from odoo.tests import tagged
+from odoo.tests.common import SavepointCase
+
+
+@tagged('-at_install', 'post_install')
+class TestTaxLineMoveLineGet(SavepointCase):
+    """ Counterpart move lines of the company withholding taxes that don't impact balance """
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestTaxLineMoveLineGet, cls).setUpClass()
+        cls.company = cls.env.user.company_id
+        account_model = cls.env['account.account']
+        liability_type = cls.env.ref('account.data_account_type_current_liabilities')
+        cls.tax_account, cls.counterpart_account = account_model.search(
+            [('company_id', '=', cls.company.id), ('user_type_id', '=', liability_type.id),
+             ('deprecated', '=', False)], limit=2)
+        cls.income_account = account_model.search(
+            [('company_id', '=', cls.company.id),
+             ('user_type_id', '=', cls.env.ref('account.data_account_type_revenue').id)], limit=1)
+
+        tax_model = cls.env['account.tax']
+        cls.taxes = tax_model.browse()
+        for sequence, include_base_amount in ((10, True), (20, False), (30, True)):
+            cls.taxes |= tax_model.create({
+                'name': 'Self withholding %s' % sequence,
+                'amount_type': 'percent',
+                'amount': 0.4,
+                'sequence': sequence,
+                'include_base_amount': include_base_amount,
+                'type_tax_use': 'sale',
+                'tax_in_invoice': True,
+                'dont_impact_balance': True,
+                'account_id': cls.tax_account.id,
+                'refund_account_id': cls.tax_account.id,
+                'account_id_counterpart': cls.counterpart_account.id,
+                'refund_account_id_counterpart': cls.counterpart_account.id,
+                'company_id': cls.company.id,
+            })
+        cls.tax_10, cls.tax_20, cls.tax_30 = cls.taxes
+
+        position = cls.env['account.fiscal.position'].create({
+            'name': 'Company withholding',
+            'company_id': cls.company.id,
+            'tax_ids_invoice': [(0, 0, {'tax_id': tax.id}) for tax in cls.taxes],
+        })
+        cls.company.partner_id.property_account_position_id = position
+
+        cls.invoice = cls.env['account.invoice'].create({
+            'partner_id': cls.env['res.partner'].create({'name': 'Customer'}).id,
+            'type': 'out_invoice',
+            'date_invoice': fields.Date.today(),
+            'invoice_line_ids': [(0, 0, {
+                'name': 'Service',
+                'account_id': cls.income_account.id,
+                'quantity': 1,
+                'price_unit': 1000000.0,
+            })],
+        })
+        cls.invoice.compute_taxes()
+
+    def _get_counterpart_lines(self):
+        return [line for line in self.invoice.tax_line_move_line_get()
+                if line['account_id'] == self.counterpart_account.id]
+
+    def test_counterpart_tax_ids(self):
+        lines = self._get_counterpart_lines()
+        # The lines follow the descending sequence of the taxes, and each tax that affects the base of the
+        # following ones gets the taxes done so far, itself included
+        self.assertEqual([line['tax_line_id'] for line in lines], [self.tax_30.id, self.tax_20.id, self.tax_10.id])
+        self.assertEqual([line['tax_ids'] for line in lines], [
+            [(6, 0, [self.tax_30.id])],
+            [],
+            [(6, 0, [self.tax_30.id, self.tax_20.id, self.tax_10.id])],
+        ])
+        for line in lines:
+            tax_line = self.invoice.tax_line_ids.filtered(lambda tax_line: tax_line.id == line['invoice_tax_line_id'])
+            self.assertEqual(line['price'], -tax_line.amount)
+            self.assertEqual(line['price_unit'], tax_line.amount)
+
+    def test_missing_counterpart_account(self):
+        self.tax_20.refund_account_id_counterpart = False
+        with self.assertRaises(UserError):
+            self.invoice.tax_line_move_line_get()
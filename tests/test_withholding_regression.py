@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#                                                                             #
+#                                                                             #
+# Part of Odoo. See LICENSE file for full copyright and licensing details.    #
+#                                                                             #
+#                                                                             #
+#                                                                             #
+# Co-Authors    Odoo LoCo                                                     #
+#               Localización funcional de Odoo para Colombia                  #
+#                                                                             #
+#                                                                             #
+# This program is free software: you can redistribute it and/or modify        #
+# it under the terms of the GNU Affero General Public License as published by #
+# the Free Software Foundation, either version 3 of the License, or           #
+# (at your option) any later version.                                         #
+#                                                                             #
+# This program is distributed in the hope that it will be useful,             #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of              #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the               #
+# GNU Affero General Public License for more details.                         #
+#                                                                             #
+# You should have received a copy of the GNU Affero General Public License    #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.       #
+###############################################################################
+
+import json
+
+from odoo.tests import tagged
+from odoo.tests.common import TransactionCase
+
+from ..scripts.benchmark_withholding import generate_dataset
+from ..scripts.withholding_regression import export_fixture, replay_fixture
+
+
+@tagged('-at_install', 'post_install')
+class TestWithholdingRegression(TransactionCase):
+    """ Export and replay round trip of the regression harness """
+
+    def test_export_replay(self):
+        dataset = generate_dataset(self.env, partners=6, positions=2, taxes=3, invoices=12, lines=2)
+        invoices = dataset['invoices']
+        invoices[:4].action_invoice_open()
+
+        fixture = export_fixture(self.env, dataset['company'], invoices)
+        self.assertEqual(len(fixture['invoices']), len(invoices))
+        self.assertTrue(any(values['recorded']['wh_taxes'] for values in fixture['invoices']))
+
+        # Same format as the gzipped file of the script
+        fixture = json.loads(json.dumps(fixture))
+        measures, differences = replay_fixture(self.env, fixture)
+        self.assertEqual(differences, {})
+        self.assertEqual([row['records'] for row in measures], [len(invoices), len(invoices), 4, 4])
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#                                                                             #
+#                                                                             #
+# Part of Odoo. See LICENSE file for full copyright and licensing details.    #
+#                                                                             #
+#                                                                             #
+#                                                                             #
+# Co-Authors    Odoo LoCo                                                     #
+#               Localización funcional de Odoo para Colombia                  #
+#                                                                             #
+#                                                                             #
+# This program is free software: you can redistribute it and/or modify        #
+# it under the terms of the GNU Affero General Public License as published by #
+# the Free Software Foundation, either version 3 of the License, or           #
+# (at your option) any later version.                                         #
+#                                                                             #
+# This program is distributed in the hope that it will be useful,             #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of              #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the               #
+# GNU Affero General Public License for more details.                         #
+#                                                                             #
+# You should have received a copy of the GNU Affero General Public License    #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.       #
+###############################################################################
+
+import base64
+
+from odoo import api, fields, models
+from odoo.exceptions import UserError
+from odoo.tools.translate import _
+
+
+class AccountBaseTaxRollover(models.TransientModel):
+    """ This wizard creates the base taxes of a whole year from the new UVT value,
+    or imports them from a CSV file"""
+
+    _name = 'account.base.tax.rollover'
+    _description = 'Wizard to create the yearly base taxes'
+
+    def _default_start_date(self):
+        return fields.Date.context_today(self).replace(month=1, day=1)
+
+    def _default_end_date(self):
+        return fields.Date.context_today(self).replace(month=12, day=31)
+
+    uvt_value = fields.Float(string='UVT value', digits=0)
+    start_date = fields.Date(string='Since date', required=True, default=_default_start_date)
+    end_date = fields.Date(string='Until date', required=True, default=_default_end_date)
+    company_ids = fields.Many2many('res.company', string='Companies',
+                                   help='Leave empty to use the taxes of all the companies')
+    line_ids = fields.One2many('account.base.tax.rollover.line', 'wizard_id', string='Taxes')
+    csv_file = fields.Binary(string='CSV file',
+                             help='File with the columns tax_id, start_date, end_date and amount')
+    csv_filename = fields.Char(string='CSV file name')
+
+    @api.onchange('company_ids')
+    def _onchange_company_ids(self):
+        if self._context.get('active_model') == 'account.tax' and self._context.get('active_ids'):
+            taxes = self.env['account.tax'].browse(self._context['active_ids'])
+        else:
+            domain = [('uvt_base', '>', 0)]
+            if self.company_ids:
+                domain.append(('company_id', 'in', self.company_ids.ids))
+            taxes = self.env['account.tax'].search(domain)
+        self.line_ids = [(5, 0, 0)] + [(0, 0, {'tax_id': tax.id, 'uvt_base': tax.uvt_base}) for tax in taxes]
+
+    @api.multi
+    def action_create_thresholds(self):
+        self.ensure_one()
+        if self.uvt_value <= 0:
+            raise UserError(_('The UVT value must be positive.'))
+        multipliers = {line.tax_id.id: line.uvt_base for line in self.line_ids if line.uvt_base > 0}
+        if not multipliers:
+            raise UserError(_('There is no tax with a base in UVT.'))
+
+        # Keep the bases in UVT on the taxes for the next rollover, one write per distinct value
+        changed = {}
+        for line in self.line_ids:
+            if line.uvt_base > 0 and line.uvt_base != line.tax_id.uvt_base:
+                changed.setdefault(line.uvt_base, self.env['account.tax'])
+                changed[line.uvt_base] |= line.tax_id
+        for uvt_base, taxes in changed.items():
+            taxes.write({'uvt_base': uvt_base})
+
+        base_taxes = self.env['account.base.tax'].create_uvt_thresholds(
+            self.uvt_value, multipliers, self.start_date, self.end_date)
+        return self._action_view_base_taxes(base_taxes)
+
+    @api.multi
+    def action_import_csv(self):
+        self.ensure_one()
+        if not self.csv_file:
+            raise UserError(_('You must select a CSV file.'))
+        data = base64.b64decode(self.csv_file).decode('utf-8-sig')
+        base_taxes = self.env['account.base.tax'].import_thresholds_csv(data)
+        return self._action_view_base_taxes(base_taxes)
+
+    def _action_view_base_taxes(self, base_taxes):
+        return {
+            'name': _('Base taxes'),
+            'type': 'ir.actions.act_window',
+            'res_model': 'account.base.tax',
+            'view_mode': 'tree,form',
+            'domain': [('id', 'in', base_taxes.ids)],
+        }
+
+
+class AccountBaseTaxRolloverLine(models.TransientModel):
+    _name = 'account.base.tax.rollover.line'
+    _description = 'Tax of the yearly base taxes wizard'
+
+    wizard_id = fields.Many2one('account.base.tax.rollover', required=True, ondelete='cascade')
+    tax_id = fields.Many2one('account.tax', string='Tax', required=True)
+    uvt_base = fields.Float(string='Base in UVT', digits=0)
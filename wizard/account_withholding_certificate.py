@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#                                                                             #
+#                                                                             #
+# Part of Odoo. See LICENSE file for full copyright and licensing details.    #
+#                                                                             #
+#                                                                             #
+#                                                                             #
+# Co-Authors    Odoo LoCo                                                     #
+#               Localización funcional de Odoo para Colombia                  #
+#                                                                             #
+#                                                                             #
+# This program is free software: you can redistribute it and/or modify        #
+# it under the terms of the GNU Affero General Public License as published by #
+# the Free Software Foundation, either version 3 of the License, or           #
+# (at your option) any later version.                                         #
+#                                                                             #
+# This program is distributed in the hope that it will be useful,             #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of              #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the               #
+# GNU Affero General Public License for more details.                         #
+#                                                                             #
+# You should have received a copy of the GNU Affero General Public License    #
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.       #
+###############################################################################
+
+import base64
+import csv
+import io
+from itertools import groupby
+
+from odoo import api, fields, models
+from odoo.exceptions import AccessError, UserError
+from odoo.tools.translate import _
+
+# SQL expression of the first day of the period of the invoice date
+PERIOD_EXPRESSIONS = {
+    'month': "date_trunc('month', inv.date_invoice)::date",
+    'bimester': "(date_trunc('year', inv.date_invoice) + "
+                "((extract(month FROM inv.date_invoice)::int - 1) / 2 * 2) * interval '1 month')::date",
+    'year': "date_trunc('year', inv.date_invoice)::date",
+}
+
+
+class AccountWithholdingCertificate(models.TransientModel):
+    """ This wizard exports the withholding certificates of the vendors: base and withheld amounts
+    per partner, tax and period, aggregated by the database"""
+
+    _name = 'account.withholding.certificate'
+    _description = 'Wizard to export the withholding certificates'
+
+    def _default_date_from(self):
+        return fields.Date.context_today(self).replace(year=fields.Date.context_today(self).year - 1, month=1, day=1)
+
+    def _default_date_to(self):
+        return fields.Date.context_today(self).replace(year=fields.Date.context_today(self).year - 1, month=12, day=31)
+
+    company_id = fields.Many2one('res.company', string='Company', required=True,
+                                 default=lambda self: self.env.user.company_id,
+                                 domain=lambda self: [('id', 'in', self.env.user.company_ids.ids)])
+    date_from = fields.Date(string='Since date', required=True, default=_default_date_from)
+    date_to = fields.Date(string='Until date', required=True, default=_default_date_to)
+    period = fields.Selection([('month', 'Month'),
+                               ('bimester', 'Bimester'),
+                               ('year', 'Year')], string='Period', required=True, default='year')
+    partner_ids = fields.Many2many('res.partner', string='Partners', help='Leave empty for all the vendors')
+    tax_ids = fields.Many2many('account.tax', string='Taxes',
+                               help='Leave empty for all the taxes of the fiscal positions')
+    csv_file = fields.Binary(string='File', readonly=True)
+    csv_filename = fields.Char(string='File name', readonly=True)
+
+    @api.multi
+    def _iter_certificate_rows(self, chunk_size=2000):
+        """
+        Yields the certificate rows ordered by partner, tax and period. The aggregation is done by a single
+        query read through a server-side cursor, so the client only holds chunk_size rows at a time
+        @return: generator of dict
+        """
+        self.ensure_one()
+        # The query bypasses the record rules, so the company is checked against the companies of the user
+        if self.company_id not in self.env.user.company_ids:
+            raise AccessError(_('You are not allowed to export the withholding certificates of %s.')
+                              % self.company_id.name)
+        tax_ids = self.tax_ids.ids or list(self.env['account.fiscal.position']._get_all_wh_tax_ids())
+        if not tax_ids:
+            return
+        params = {
+            'company_id': self.company_id.id,
+            'date_from': self.date_from,
+            'date_to': self.date_to,
+            'tax_ids': tuple(tax_ids),
+            'partner_ids': tuple(self.partner_ids.mapped('commercial_partner_id').ids) or (None,),
+            'all_partners': not self.partner_ids,
+        }
+        query = """
+            SELECT partner.id AS partner_id, partner.name AS partner_name, partner.vat AS partner_vat,
+                   tax.id AS tax_id, tax.name AS tax_name, tax_group.name AS tax_group,
+                   totals.period, currency.name AS currency, totals.base, totals.amount
+              FROM (SELECT inv.commercial_partner_id, ait.tax_id, inv.currency_id, {period} AS period,
+                           SUM(CASE WHEN inv.type = 'in_refund' THEN -ait.base ELSE ait.base END) AS base,
+                           -SUM(CASE WHEN inv.type = 'in_refund' THEN -ait.amount ELSE ait.amount END) AS amount
+                      FROM account_invoice_tax ait
+                      JOIN account_invoice inv ON inv.id = ait.invoice_id
+                     WHERE inv.state IN ('open', 'in_payment', 'paid')
+                       AND inv.type IN ('in_invoice', 'in_refund')
+                       AND inv.company_id = %(company_id)s
+                       AND inv.date_invoice BETWEEN %(date_from)s AND %(date_to)s
+                       AND ait.tax_id IN %(tax_ids)s
+                       AND (%(all_partners)s OR inv.commercial_partner_id IN %(partner_ids)s)
+                  GROUP BY inv.commercial_partner_id, ait.tax_id, inv.currency_id, {period}) totals
+              JOIN res_partner partner ON partner.id = totals.commercial_partner_id
+              JOIN account_tax tax ON tax.id = totals.tax_id
+         LEFT JOIN account_tax_group tax_group ON tax_group.id = tax.tax_group_id
+              JOIN res_currency currency ON currency.id = totals.currency_id
+          ORDER BY partner.name, partner.id, tax.name, totals.period
+        """.format(period=PERIOD_EXPRESSIONS[self.period])
+        # A plain cursor would transfer the whole result at execute, FETCH only transfers one chunk
+        cursor_name = 'withholding_certificate_%s' % self.id
+        self.env.cr.execute('DECLARE %s NO SCROLL CURSOR FOR %s' % (cursor_name, query), params)
+        try:
+            while True:
+                self.env.cr.execute('FETCH FORWARD %s FROM ' + cursor_name, (chunk_size,))
+                rows = self.env.cr.dictfetchall()
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            self.env.cr.execute('CLOSE ' + cursor_name)
+
+    @api.multi
+    def _get_certificates(self):
+        """
+        Returns the rows grouped by partner, for the PDF report
+        @return: list of (partner, rows)
+        """
+        partners = self.env['res.partner']
+        return [(partners.browse(partner_id), list(rows))
+                for partner_id, rows in groupby(self._iter_certificate_rows(), key=lambda row: row['partner_id'])]
+
+    @api.multi
+    def action_export_csv(self):
+        """
+        Writes the certificate rows to the CSV file of the wizard. The rows are read in chunks, but the file
+        itself is built in memory and stored as a binary field, so its size is bounded by the aggregated
+        output, one row per partner, tax and period
+        @return: action reopening the wizard
+        """
+        self.ensure_one()
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(['partner_vat', 'partner', 'tax_group', 'tax', 'period', 'currency', 'base', 'amount'])
+        for row in self._iter_certificate_rows():
+            writer.writerow([row['partner_vat'] or '', row['partner_name'], row['tax_group'] or '', row['tax_name'],
+                             row['period'], row['currency'], row['base'], row['amount']])
+        self.write({
+            'csv_file': base64.b64encode(output.getvalue().encode('utf-8')),
+            'csv_filename': 'withholding_certificates_%s_%s.csv' % (self.date_from, self.date_to),
+        })
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': self._name,
+            'res_id': self.id,
+            'view_mode': 'form',
+            'target': 'new',
+        }
+
+    @api.multi
+    def action_print_pdf(self):
+        self.ensure_one()
+        if not self.partner_ids:
+            raise UserError(_('Select the partners of the certificates to print, or export all of them to CSV.'))
+        return self.env.ref('l10n_co_tax_extension.action_report_withholding_certificate').report_action(self)